@@ -1,41 +1,116 @@
 # app.py
-from flask import Flask, request, render_template, redirect, url_for, session
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required
+import gzip
+import logging
+import os
+import time
+from flask import Flask, Response, abort, g, jsonify, request, render_template, redirect, url_for, session
+from flask_login import LoginManager, UserMixin, current_user, login_user, logout_user, login_required
 from database import *
 from main import *
+import metrics
+from auth import UserSessions
+from fragments import FragmentCache
+from profiling import RequestProfiler
+from storage import get_backend
+from valuation import PortfolioValuation, to_json
+
+logging.basicConfig(level=os.environ.get('COINTRACKER_LOG_LEVEL', 'INFO'))
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, template_folder='html')  # app with template folder = html
 app.secret_key = 'cointracker_pt'  
 login_manager = LoginManager()  # instance of LoginManager
 login_manager.init_app(app)  # initialize LoginManager with Flask app
+profiler = RequestProfiler(app)  # opt-in per-request profiling (admin header or sampling)
+
+# Import databases (DynamoDB or SQLite, see storage.py)
+storage_backend = get_backend()
+users_db = storage_backend.users()
+user_sessions = UserSessions(users_db)  # cached user loading + password hashing
+btc_balances_db = storage_backend.btc_balances()
+transactions_db = storage_backend.transactions()
 
-# Import databases
-users_db = UsersDB()
-btc_balances_db = BTCBalancesDB()
-transactions_db = TransactionsDB()
+# Classes from BlockChain API (one instance, so syncs and retrieves share its short-lived caches)
+blockchain_api = BlockChainAPI()
 
 # Classes from main.py
 bitcoin_addresses = BitcoinAddresses()
-sync = SynchronizeBitcoinAddress()
-retrieve_data = RetrieveData()
+sync = SynchronizeBitcoinAddress(blockchain_api)
+retrieve_data = RetrieveData(sync)
+portfolio_valuation = PortfolioValuation()  # fiat values from local price series (see valuation.py)
 
-# Classes from BlockChain API
-blockchain_api = BlockChainAPI()
+# Pagination and rendered-fragment caching
+TRANSACTIONS_PAGE_SIZE = 20  # transactions per page on /transactions
+RETRIEVE_TRANSACTIONS = 50  # latest transactions (across all addresses) on the retrieve page
+GZIP_MIN_SIZE = 1024  # bytes; smaller bodies are not worth compressing
+fragment_cache = FragmentCache()
 
 class User(UserMixin):
     pass
 
-# LOAD USERS
+# REQUEST METRICS
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUEST_LATENCY.observe(time.perf_counter() - start, route=route,
+                                             method=request.method, status=response.status_code)
+    return response
+
+# RESPONSE COMPRESSION
+@app.after_request
+def compress_response(response):
+    if not 200 <= response.status_code < 300 or response.direct_passthrough or \
+            'Content-Encoding' in response.headers or \
+            'gzip' not in request.headers.get('Accept-Encoding', '').lower() or \
+            not ((response.mimetype or '').startswith('text/') or response.mimetype == 'application/json'):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = len(response.get_data())
+    response.vary.add('Accept-Encoding')
+    return response
+
+# METRICS (Prometheus text format)
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_latest(), content_type=metrics.CONTENT_TYPE_LATEST)
+
+def make_user(user_data: dict) -> User:
+    user = User()
+    user.id = user_data['username']
+    return user
+
+# LOAD USERS (served from the in-memory user cache)
 @login_manager.user_loader
 def load_user(username):
-    user_data = users_db.get_user(username)
+    user_data = user_sessions.load_user(username)
     if user_data:
-        user = User()
-        user.id = user_data['username']
-        user.password = user_data['password']
-        return user
+        return make_user(user_data)
     return None
 
+def render_transactions_table(btc_address: str, sync_version: str, cursor: str = None):
+    """
+    Rendered transactions table (one page) for btc_address, cached per sync version so
+    unchanged addresses are neither re-queried nor re-rendered.
+    """
+    def render():
+        transactions, next_cursor = sync.get_transactions_page(btc_address, TRANSACTIONS_PAGE_SIZE, cursor)
+        return render_template('_transactions_table.html', btc_address=btc_address, transactions=transactions,
+                               cursor=cursor, next_cursor=next_cursor)
+    if sync_version is None:  # never synced: nothing stable to key the cache on
+        return render()
+    key = ('transactions_table', btc_address, sync_version, cursor, TRANSACTIONS_PAGE_SIZE)
+    return fragment_cache.get_or_render(key, render)
+
 # HOME
 @app.route('/')
 def home():
@@ -55,7 +130,7 @@ def register():
             return render_template('login.html', error=error)
 
         # Attempt to add the new user
-        if users_db.add_user(username, password):
+        if user_sessions.register(username, password):
             return render_template('registration_success.html', username=username)
         else:
             return f"Failed to register user '{username}'. Please try again."
@@ -68,15 +143,11 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        # Retrieve user data from database
-        user_data = users_db.get_user(username)
+        # Validate user credentials against the stored password hash
+        user_data = user_sessions.authenticate(username, password)
 
-        # Validate user credentials
-        if user_data and user_data['password'] == password:
-            user = User()
-            user.id = user_data['username']
-            user.password = user_data['password']
-            login_user(user)  # Log in the user
+        if user_data:
+            login_user(make_user(user_data))  # Log in the user
             return redirect(url_for('loggedin', username=username))
         else:
             error = "Incorrect username or password. Please try again or register if you're a new user."
@@ -103,8 +174,10 @@ def loggedin():
             
             elif bitcoin_addresses.add_address(btc_address, username):
                 message = f"Hi {username}. You've successfully added '{btc_address}' to CoinTracker!"
-                # Add BTC_Address and transaction to Transactions DB to use later
-                sync.add_transactions(username, btc_address)
+                # Add transactions to Transactions DB to use later; address data is shared
+                # between users, so it is only fetched the first time anyone adds the address
+                if not bitcoin_addresses.is_synced(btc_address):
+                    sync.add_transactions(btc_address)
                 return render_template('loggedin.html', username=username, message=message)
             
             else:
@@ -119,7 +192,7 @@ def loggedin():
                 return render_template('loggedin.html', username=username, message=message)
             
             elif btc_address in bitcoin_addresses.get_btc_addresses_for_user(username) and \
-                bitcoin_addresses.remove_address(btc_address):
+                bitcoin_addresses.remove_address(btc_address, username):
                 message = f"Hi {username}. You've successfully removed BTC address '{btc_address}' from CoinTracker!"
                 return render_template('loggedin.html', username=username, message=message)
             
@@ -130,31 +203,62 @@ def loggedin():
         # Feature 2: Synchronize BTC transactions with BTC addresses
         elif action == 'btc_transactions':
             btc_addresses = bitcoin_addresses.get_btc_addresses_for_user(username)
-            btc_transactions = {}
+            sync.sync_addresses(btc_addresses)  # only re-fetches addresses that changed
+            sync_versions = bitcoin_addresses.get_sync_versions(btc_addresses)
+            transaction_tables = [render_transactions_table(btc_address, sync_versions.get(btc_address))
+                                  for btc_address in sorted(btc_addresses)]
 
-            for btc_address in btc_addresses:
-                transactions_for_btc_address = sync.get_transactions_table_for_btc_address(btc_address)
-                btc_transactions[btc_address] = transactions_for_btc_address
-            
             num_of_btc_addresses = retrieve_data.number_of_btc_addreses_owned(btc_addresses)
-            return render_template('transactions.html', username=username, btc_transactions=btc_transactions, num_of_btc_addresses=num_of_btc_addresses)
+            return render_template('transactions.html', username=username, transaction_tables=transaction_tables,
+                                   num_of_btc_addresses=num_of_btc_addresses, page_size=TRANSACTIONS_PAGE_SIZE)
         
         # Feature 3: Synchronize BTC transactions with BTC addresses
         elif action == 'retrieve':
             btc_addresses = bitcoin_addresses.get_btc_addresses_for_user(username)
+            sync.sync_addresses(btc_addresses)  # only re-fetches addresses that changed
             num_of_btc_addresses = retrieve_data.number_of_btc_addreses_owned(btc_addresses)
             btc_addresses_data = retrieve_data.get_btc_and_balance_data(btc_addresses)
             total_btc_owned = retrieve_data.get_total_amount(btc_addresses)
-            btc_transactions = retrieve_data.get_btc_transactions(btc_addresses)
-            return render_template('retrieve.html', username=username, btc_addresses=btc_addresses_data, btc_transactions=btc_transactions, total_btc_owned=total_btc_owned, num_of_btc_addresses=num_of_btc_addresses)
+            btc_transactions = retrieve_data.get_btc_transactions(btc_addresses, RETRIEVE_TRANSACTIONS)
+            valuations = [valuation for valuation in (portfolio_valuation.value_portfolio(username, btc_addresses, currency)
+                                                      for currency in portfolio_valuation.prices.currencies()) if valuation]
+            return render_template('retrieve.html', username=username, btc_addresses=btc_addresses_data, btc_transactions=btc_transactions, total_btc_owned=total_btc_owned, num_of_btc_addresses=num_of_btc_addresses, valuations=valuations)
     
     return render_template('loggedin.html', username=username)
 
+# TRANSACTIONS OF ONE ADDRESS (paginated, ?cursor=<from the previous page>)
+@app.route('/transactions/<btc_address>')
+@login_required
+def address_transactions(btc_address):
+    username = current_user.get_id()
+    if btc_address not in bitcoin_addresses.get_btc_addresses_for_user(username):
+        abort(404)
+    cursor = request.args.get('cursor') or None
+    sync_version = bitcoin_addresses.get_sync_versions([btc_address]).get(btc_address)
+    transaction_table = render_transactions_table(btc_address, sync_version, cursor)
+    return render_template('transactions.html', username=username, transaction_tables=[transaction_table],
+                           num_of_btc_addresses=1, page_size=TRANSACTIONS_PAGE_SIZE)
+
+# PORTFOLIO VALUE OVER TIME (JSON, ?currency=USD)
+@app.route('/valuation')
+@login_required
+def valuation():
+    username = current_user.get_id()
+    btc_addresses = bitcoin_addresses.get_btc_addresses_for_user(username)
+    try:
+        result = portfolio_valuation.value_portfolio(username, btc_addresses, request.args.get('currency', 'USD'))
+    except ValueError:
+        abort(400)
+    if result is None:
+        abort(404)  # no price series for the currency
+    return jsonify(to_json(result))
+
 # LOGOUT
 @app.route('/logout', methods=['GET', 'POST'])
 @login_required
 def logout():
     if request.method == 'POST':
+        user_sessions.logout(current_user.get_id())
         logout_user()  # Log out the user
         session.pop('username', None)
         return redirect(url_for('home'))  # Redirect to home page after logout
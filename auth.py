@@ -0,0 +1,180 @@
+# auth.py
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasher:
+    """
+    Salted scrypt password hashing on a bounded thread pool.
+
+    scrypt is deliberately slow and memory hungry; running it on a small dedicated pool
+    caps how many logins hash concurrently so they cannot starve other requests.
+    Hashes are stored as 'scrypt$n$r$p$<salt hex>$<hash hex>'.
+    """
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1, max_workers: int = None):
+        self.n = n
+        self.r = r
+        self.p = p
+        max_workers = max_workers or int(os.environ.get('COINTRACKER_KDF_WORKERS', 4))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kdf')
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r, dklen=32)
+
+    def hash_password(self, password: str) -> str:
+        """
+        Hash password with a fresh random salt.
+        """
+        salt = os.urandom(16)
+        with metrics.timer(metrics.KDF_LATENCY, operation='hash'):
+            derived = self._executor.submit(self._derive, password, salt, self.n, self.r, self.p).result()
+        return f'scrypt${self.n}${self.r}${self.p}${salt.hex()}${derived.hex()}'
+
+    def verify_password(self, password: str, password_hash: str) -> bool:
+        """
+        Check password against a hash produced by `hash_password`.
+        """
+        try:
+            algorithm, n, r, p, salt, expected = password_hash.split('$')
+            if algorithm != 'scrypt':
+                return False
+            with metrics.timer(metrics.KDF_LATENCY, operation='verify'):
+                derived = self._executor.submit(self._derive, password, bytes.fromhex(salt),
+                                                int(n), int(r), int(p)).result()
+            return hmac.compare_digest(derived.hex(), expected)
+        except (ValueError, AttributeError) as e:
+            logger.warning("Malformed password hash: %s", e)
+            return False
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Whether a stored hash uses weaker parameters than the current ones.
+        """
+        return not password_hash.startswith(f'scrypt${self.n}${self.r}${self.p}$')
+
+
+class UserCache:
+    """
+    In-memory TTL + LRU cache of loaded user records, keyed by username.
+    """
+    def __init__(self, ttl: float = None, max_entries: int = 10000):
+        self.ttl = ttl if ttl is not None else float(os.environ.get('COINTRACKER_USER_CACHE_TTL', 300))
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()  # username -> (expires_at, user_data)
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(username)
+                metrics.record_cache('users', True)
+                return entry[1]
+            if entry:
+                del self._entries[username]
+        metrics.record_cache('users', False)
+        return None
+
+    def put(self, username: str, user_data: dict) -> None:
+        with self._lock:
+            self._entries[username] = (time.monotonic() + self.ttl, user_data)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+
+class UserSessions:
+    """
+    Registration, credential checks and cached user loading on top of UsersDB.
+
+    Loading the logged-in user on every request is served from `UserCache`, so
+    authenticated page views do not pay a DynamoDB round trip.
+    """
+    # Fields safe to keep in memory and hand to the session layer (no credentials).
+    PUBLIC_FIELDS = ('username', 'time_registered')
+
+    def __init__(self, users_db, hasher: PasswordHasher = None, cache: UserCache = None):
+        self.users_db = users_db
+        self.hasher = hasher or get_hasher()
+        self.cache = cache or UserCache()
+
+    def _public(self, user_data: dict) -> dict:
+        return {field: user_data[field] for field in self.PUBLIC_FIELDS if field in user_data}
+
+    def load_user(self, username: str) -> Optional[dict]:
+        """
+        User record for username, from the cache when possible.
+        """
+        user_data = self.cache.get(username)
+        if user_data is None:
+            stored = self.users_db.get_user(username)
+            if stored is None:
+                return None
+            user_data = self._public(stored)
+            self.cache.put(username, user_data)
+        return user_data
+
+    def register(self, username: str, password: str) -> bool:
+        if self.users_db.add_user(username, password):
+            self.cache.invalidate(username)
+            return True
+        return False
+
+    def authenticate(self, username: str, password: str) -> Optional[dict]:
+        """
+        Check credentials against the stored hash. Records written before password hashing
+        (plaintext 'password') are verified once and upgraded to a salted hash.
+
+        Returns:
+            The user record if the credentials are valid, else None.
+        """
+        stored = self.users_db.get_user(username)
+        if stored is None:
+            return None
+        password_hash = stored.get('password_hash')
+        if password_hash:
+            if not self.hasher.verify_password(password, password_hash):
+                return None
+            if self.hasher.needs_rehash(password_hash):
+                self.users_db.set_password_hash(username, self.hasher.hash_password(password))
+        elif 'password' in stored and hmac.compare_digest(str(stored['password']), password):
+            self.users_db.set_password_hash(username, self.hasher.hash_password(password))
+        else:
+            return None
+        user_data = self._public(stored)
+        self.cache.put(username, user_data)
+        return user_data
+
+    def logout(self, username: str) -> None:
+        self.cache.invalidate(username)
+
+
+_default_hasher: Optional[PasswordHasher] = None
+_default_hasher_lock = threading.Lock()
+
+
+def get_hasher() -> PasswordHasher:
+    """
+    Process-wide PasswordHasher, so all logins share one bounded KDF pool.
+    """
+    global _default_hasher
+    with _default_hasher_lock:
+        if _default_hasher is None:
+            _default_hasher = PasswordHasher()
+        return _default_hasher
@@ -0,0 +1,328 @@
+# benchmarks.py
+"""
+Offline benchmarks for the sync, retrieve and history paths.
+
+Runs against moto's in-memory DynamoDB (or a temporary SQLite file with --backend sqlite)
+and a fake BlockChain.com provider that serves synthetic wallets, so no AWS account or
+network access is needed.
+
+    python benchmarks.py --transactions 1000 --addresses 10 --save-baseline
+    python benchmarks.py --transactions 1000 --addresses 10 --compare
+    python benchmarks.py --transactions 1000 --addresses 10 --backend sqlite
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from unittest.mock import patch
+
+import numpy as np
+
+import storage
+from blockchain_com_api import BlockChainAPI
+from valuation import PortfolioValuation, PriceSeries, PriceStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE_PATH = 'benchmarks_baseline.json'
+SATOSHI = 100000000
+
+
+class FakeBlockChainAPI(BlockChainAPI):
+    """
+    BlockChainAPI stand-in serving deterministic synthetic wallets from memory.
+    Any address starting with 'fake' is valid and has `num_of_transactions` transactions.
+    """
+    def __init__(self, num_of_transactions: int = 100, seed: int = 0):
+        super().__init__()
+        self.num_of_transactions = num_of_transactions
+        self.seed = seed
+        self.chain_height = 800000
+        self._wallets: Dict[str, dict] = {}
+
+    def _wallet(self, btc_address: str) -> dict:
+        wallet = self._wallets.get(btc_address)
+        if wallet is None:
+            rng = random.Random(f'{self.seed}:{btc_address}')
+            now = 1700000000
+            balance = 0
+            txs = []
+            for i in range(self.num_of_transactions):
+                amount = rng.randint(-balance, SATOSHI) if balance else rng.randint(1, SATOSHI)
+                balance += amount
+                txs.append({
+                    'hash': f'{rng.getrandbits(256):064x}',
+                    'time': now - i * 600,
+                    'block_height': self.chain_height - 100 - i,  # dormant: latest tx well confirmed
+                    'result': amount,
+                    'balance': balance,
+                    'fee': rng.randint(100, 10000),
+                })
+            wallet = self._wallets[btc_address] = {
+                'address': btc_address,
+                'n_tx': len(txs),
+                'final_balance': balance,
+                'txs': txs,  # latest first, like /rawaddr
+            }
+        return wallet
+
+    def history(self, btc_address: str) -> List[dict]:
+        """
+        Every transaction of btc_address (not just the latest /rawaddr page), latest first.
+        """
+        return self._wallet(btc_address)['txs']
+
+    def valid_btc_address(self, btc_address: str) -> bool:
+        return btc_address.startswith('fake')
+
+    def get_data(self, btc_address: str) -> List[Any]:
+        if not self.valid_btc_address(btc_address):
+            return {'error': 'not-found-or-invalid-arg'}
+        wallet = self._wallet(btc_address)
+        return dict(wallet, txs=wallet['txs'][:self.RAWADDR_LIMIT])  # one page, like /rawaddr
+
+    def get_balance(self, btc_address: str) -> float:
+        return self._wallet(btc_address)['final_balance']
+
+    def get_summary(self, btc_addresses: List[str]) -> Dict[str, dict]:
+        summaries = {}
+        for btc_address in btc_addresses:
+            if self.valid_btc_address(btc_address):
+                wallet = self._wallet(btc_address)
+                summaries[btc_address] = {'final_balance': wallet['final_balance'], 'n_tx': wallet['n_tx'],
+                                          'total_received': 0}
+        return summaries
+
+    def get_latest_block(self) -> dict:
+        return {'hash': f'{self.chain_height:064x}', 'height': self.chain_height, 'time': 1700000000}
+
+    def add_transaction(self, btc_address: str, amount: int, fee: int = 1000) -> None:
+        """
+        Simulate a new transaction for btc_address, mined in a new block.
+        """
+        wallet = self._wallet(btc_address)
+        self.chain_height += 1
+        balance = wallet['final_balance'] + amount
+        wallet['txs'].insert(0, {
+            'hash': f'{random.Random(f"{btc_address}:{self.chain_height}").getrandbits(256):064x}',
+            'time': wallet['txs'][0]['time'] + 600 if wallet['txs'] else 1700000000,
+            'block_height': self.chain_height,
+            'result': amount,
+            'balance': balance,
+            'fee': fee,
+        })
+        wallet['n_tx'] += 1
+        wallet['final_balance'] = balance
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of `samples` (pct in 0-100).
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def measure(fn: Callable[[], Any], iterations: int) -> dict:
+    """
+    Call `fn` `iterations` times and summarise throughput and latency in milliseconds.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    elapsed = time.perf_counter() - start
+    return {
+        'iterations': iterations,
+        'throughput_per_s': iterations / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': statistics.mean(latencies) if latencies else 0.0,
+    }
+
+
+def _mock_aws():
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    try:
+        from moto import mock_aws  # moto >= 5
+    except ImportError:
+        try:
+            from moto import mock_dynamodb as mock_aws  # moto 4
+        except ImportError:
+            raise SystemExit("benchmarks.py requires moto: pip install 'moto[dynamodb]'")
+    return mock_aws()
+
+
+def seed_transactions(transactions_db, fake_api: FakeBlockChainAPI, btc_addresses: List[str],
+                      page_size: int = 20, chunk_size: int = 1000) -> Iterator[Tuple[str, int, str]]:
+    """
+    Bulk-store the full synthetic history of every address.
+
+    Returns:
+        An endless cycle of (btc_address, page_size, cursor) arguments for `get_page` that
+        read the last (oldest) page of each address.
+    """
+    deepest = []
+    for btc_address in btc_addresses:
+        items = [transactions_db.to_item(btc_address, tx['hash'], tx['time'], tx['fee'], tx['balance'])
+                 for tx in fake_api.history(btc_address)]
+        for start in range(0, len(items), chunk_size):
+            transactions_db.add_transactions(items[start:start + chunk_size])
+        cursor = items[-page_size - 1]['tx_key'] if len(items) > page_size else None
+        deepest.append((btc_address, page_size, cursor))
+    return itertools.cycle(deepest)
+
+
+def seed_prices(price_dir: str, fake_api: FakeBlockChainAPI, btc_addresses: List[str]) -> PriceStore:
+    """
+    Hourly synthetic BTC-USD prices spanning every stored transaction.
+    """
+    times = [tx['time'] for btc_address in btc_addresses for tx in fake_api.history(btc_address)]
+    timestamps = np.arange(min(times) - 3600, max(times) + 3600, 3600)
+    prices = 30000 + 5000 * np.sin(timestamps / 86400)
+    store = PriceStore(price_dir)
+    PriceSeries.write(store.path('USD'), timestamps, prices)
+    return store
+
+
+def run_benchmarks(num_of_transactions: int, num_of_addresses: int, iterations: int, seed: int = 0,
+                   backend: str = storage.BACKEND_DYNAMODB) -> dict:
+    """
+    Build a synthetic user with `num_of_addresses` wallets of `num_of_transactions` each
+    and benchmark the sync, retrieve and Flask route paths on the given storage backend.
+    Syncs store the latest /rawaddr page; the full histories are then bulk-stored so deep
+    pages, history reads and valuations run over `num_of_transactions` rows per address.
+    """
+    fake_api = FakeBlockChainAPI(num_of_transactions, seed)
+    results = {}
+    with ExitStack() as stack:
+        if backend == storage.BACKEND_SQLITE:
+            tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            storage_backend = storage.SQLiteBackend(os.path.join(tmp_dir, 'benchmarks.db'))
+        else:
+            stack.enter_context(_mock_aws())
+            storage_backend = storage.DynamoDBBackend()
+        storage.set_backend(storage_backend)
+        stack.callback(storage.set_backend, None)
+        for module in ('database', 'sqlite_store', 'main'):
+            stack.enter_context(patch(f'{module}.BlockChainAPI', lambda: fake_api))
+        storage_backend.create_tables()
+        import app as flask_app
+        stack.enter_context(patch.object(flask_app, 'blockchain_api', fake_api))
+
+        username = 'bench_user'
+        password = 'bench_password'
+        btc_addresses = [f'fake{i:06d}' for i in range(num_of_addresses)]
+        flask_app.users_db.add_user(username, password)
+        for btc_address in btc_addresses:
+            flask_app.bitcoin_addresses.add_address(btc_address, username)
+
+        pending = iter(btc_addresses * (iterations // num_of_addresses + 1))
+        results['add_transactions'] = measure(
+            lambda: flask_app.sync.add_transactions(next(pending)), iterations)
+
+        # the whole wallet history is stored, so reads below scale with --transactions
+        deepest_cursors = seed_transactions(flask_app.transactions_db, fake_api, btc_addresses)
+        cycle = itertools.cycle(btc_addresses)
+        results['get_page_deepest'] = measure(
+            lambda: flask_app.transactions_db.get_page(*next(deepest_cursors)), iterations)
+        results['get_history'] = measure(
+            lambda: flask_app.transactions_db.get_history(next(cycle)), iterations)
+        price_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        valuation = PortfolioValuation(seed_prices(price_dir, fake_api, btc_addresses), storage_backend)
+        requests_made = itertools.count()  # a new user per call, so nothing is served from the cache
+        results['value_portfolio'] = measure(
+            lambda: valuation.value_portfolio(f'bench_user{next(requests_made)}', btc_addresses), iterations)
+        results['get_btc_transactions'] = measure(
+            lambda: flask_app.retrieve_data.get_btc_transactions(btc_addresses), iterations)
+        results['get_btc_and_balance_data'] = measure(
+            lambda: flask_app.retrieve_data.get_btc_and_balance_data(btc_addresses), iterations)
+
+        client = flask_app.app.test_client()
+        client.post('/login', data={'username': username, 'password': password})
+        for action in ('btc_transactions', 'retrieve'):
+            results[f'route_loggedin_{action}'] = measure(
+                lambda: client.post('/loggedin', data={'username': username, 'action': action}), iterations)
+        results['route_metrics'] = measure(lambda: client.get('/metrics'), iterations)
+
+    return {
+        'config': {'transactions': num_of_transactions, 'addresses': num_of_addresses,
+                   'iterations': iterations, 'seed': seed, 'backend': backend},
+        'results': results,
+    }
+
+
+def compare_to_baseline(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    List benchmarks whose p50 or p99 latency regressed by more than `tolerance` (0.2 = 20%).
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for stat in ('p50_ms', 'p99_ms'):
+            if previous[stat] and result[stat] > previous[stat] * (1 + tolerance):
+                regressions.append(f"{name} {stat}: {previous[stat]:.3f} -> {result[stat]:.3f}")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline CoinTracker benchmarks.')
+    parser.add_argument('--transactions', type=int, default=100, help='transactions per address (10 - 100000)')
+    parser.add_argument('--addresses', type=int, default=10, help='addresses per user (1 - 1000)')
+    parser.add_argument('--iterations', type=int, default=20, help='calls measured per benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=[storage.BACKEND_DYNAMODB, storage.BACKEND_SQLITE],
+                        default=storage.BACKEND_DYNAMODB, help='storage backend to benchmark')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write results to the baseline file')
+    parser.add_argument('--compare', action='store_true', help='fail if results regress against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed latency regression ratio')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run_benchmarks(args.transactions, args.addresses, args.iterations, args.seed, args.backend)
+
+    print(f"{'benchmark':36} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, result in report['results'].items():
+        print(f"{name:36} {result['throughput_per_s']:10.1f} {result['p50_ms']:10.3f} {result['p99_ms']:10.3f}")
+
+    status = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at '{args.baseline}'; run with --save-baseline first.")
+            return 1
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print(f"Warning: baseline config {baseline.get('config')} differs from {report['config']}.")
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        status = 1 if regressions else 0
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to '{args.baseline}'.")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,11 @@
+import logging
+import threading
+import time
 import requests
-from typing import List, Any
+from typing import List, Any, Dict, Optional
+import metrics
+
+logger = logging.getLogger(__name__)
 
 class BlockChainAPI:
     """BlockChain Data API documentation:
@@ -26,31 +32,59 @@ class BlockChainAPI:
         ]
         }
     """
-    def __init__(self):
-        pass
+    # Addresses per /balance call, keeps the URL well under common length limits.
+    SUMMARY_BATCH_SIZE = 50
+    # Transactions per /rawaddr response (the API default page size).
+    RAWADDR_LIMIT = 50
+
+    def __init__(self, summary_ttl: float = 15.0):
+        # Short-lived caches of /balance summaries and the /latestblock tip, so page views within
+        # summary_ttl of each other (e.g. a sync followed by a retrieve) share one call of each,
+        # as long as they share this instance.
+        self.summary_ttl = summary_ttl
+        self._summary_cache: Dict[str, tuple] = {}  # btc_address -> (expires_at, summary)
+        self._latest_block: Optional[tuple] = None  # (expires_at, block)
+        self._summary_lock = threading.Lock()
+
+    def _get(self, endpoint: str, url: str) -> requests.Response:
+        """
+        GET a BlockChain.com URL, recording latency and status per endpoint.
+
+        Args:
+            endpoint: short endpoint name used as the metrics label, e.g. 'rawaddr'.
+            url: full request URL.
+        """
+        status = 'error'
+        try:
+            with metrics.timer(metrics.BLOCKCHAIN_API_LATENCY, endpoint=endpoint):
+                response = requests.get(url)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.BLOCKCHAIN_API_REQUESTS.inc(endpoint=endpoint, status=status)
 
     def valid_btc_address(self, btc_address: str) -> bool:
         url = f'https://blockchain.info/rawaddr/{btc_address}'
         try:
-            response = requests.get(url)
+            response = self._get('rawaddr', url)
             if response.status_code == 200:
-                print(f"Successfully validated BTC address '{btc_address}'")
+                logger.debug("Successfully validated BTC address '%s'", btc_address)
                 return True
             else:
-                print(f"Received non-200 status code: {response.status_code}")
+                logger.info("Received non-200 status code validating '%s': %s", btc_address, response.status_code)
                 return False
         except Exception as e:
-            print(f"Could not make request to validate BTC address: {e}")
+            logger.error("Could not make request to validate BTC address: %s", e)
             return False
 
     def get_data(self, btc_address: str) -> List[Any]:
         url = f'https://blockchain.info/rawaddr/{btc_address}'
         try:
-            response = requests.get(url)
+            response = self._get('rawaddr', url)
             data = response.json()
             return data
         except Exception as e:
-            print(f"Could not get data: {e}")
+            logger.error("Could not get data: %s", e)
     
     def get_balance(self, btc_address: str) -> float:
         """
@@ -63,7 +97,74 @@ class BlockChainAPI:
             #balance = data['final_balance'] / 100000000 # Conversion of Satoshi into 
             data = self.get_data(btc_address)
             balance = data['final_balance']
-            print(f"Final balance for address '{btc_address}': {balance} BTC")
+            logger.debug("Final balance for address '%s': %s satoshi", btc_address, balance)
             return balance
         except Exception as e:
-            print(f"Failed to get balance for btc_address '{btc_address}': \n {e}")
\ No newline at end of file
+            logger.error("Failed to get balance for btc_address '%s': %s", btc_address, e)
+
+    def get_summary(self, btc_addresses: List[str]) -> Dict[str, dict]:
+        """
+        Cheap per-address summary for many addresses via /balance (no transaction list).
+
+        Returns:
+            {btc_address: {'final_balance': int, 'n_tx': int, 'total_received': int}} for every
+            address the API answered for; addresses that failed are left out.
+        """
+        summaries = {}
+        missing = []
+        now = time.monotonic()
+        with self._summary_lock:
+            for btc_address in dict.fromkeys(btc_addresses):
+                cached = self._summary_cache.get(btc_address)
+                if cached and cached[0] > now:
+                    summaries[btc_address] = cached[1]
+                else:
+                    missing.append(btc_address)
+        for _ in summaries:
+            metrics.record_cache('blockchain_summary', True)
+        for _ in missing:
+            metrics.record_cache('blockchain_summary', False)
+
+        for start in range(0, len(missing), self.SUMMARY_BATCH_SIZE):
+            batch = missing[start:start + self.SUMMARY_BATCH_SIZE]
+            url = f"https://blockchain.info/balance?active={'|'.join(batch)}"
+            try:
+                response = self._get('balance', url)
+                if response.status_code != 200:
+                    logger.info("Received non-200 status code for balance summary: %s", response.status_code)
+                    continue
+                fetched = response.json()
+            except Exception as e:
+                logger.error("Could not get balance summary: %s", e)
+                continue
+            expires_at = time.monotonic() + self.summary_ttl
+            with self._summary_lock:
+                for btc_address, summary in fetched.items():
+                    self._summary_cache[btc_address] = (expires_at, summary)
+            summaries.update(fetched)
+        return summaries
+
+    def get_latest_block(self) -> dict:
+        """
+        Current chain tip via /latestblock, cached for `summary_ttl` seconds.
+
+        Returns:
+            {'hash': str, 'time': int, 'block_index': int, 'height': int}, or None on failure.
+        """
+        with self._summary_lock:
+            cached = self._latest_block
+        hit = cached is not None and cached[0] > time.monotonic()
+        metrics.record_cache('blockchain_latest_block', hit)
+        if hit:
+            return cached[1]
+        try:
+            response = self._get('latestblock', 'https://blockchain.info/latestblock')
+            if response.status_code == 200:
+                block = response.json()
+                with self._summary_lock:
+                    self._latest_block = (time.monotonic() + self.summary_ttl, block)
+                return block
+            logger.info("Received non-200 status code for latest block: %s", response.status_code)
+        except Exception as e:
+            logger.error("Could not get latest block: %s", e)
+        return None
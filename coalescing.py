@@ -0,0 +1,151 @@
+# coalescing.py
+import logging
+import os
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Callable, Hashable, Iterable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value):
+    # DynamoDB returns numbers as Decimal; compare them equal to the ints we write.
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+class WriteCoalescer:
+    """
+    Buffers upserts to one table and writes them in batches.
+
+    - Repeated upserts of the same key while pending collapse into the latest one.
+    - Upserts identical to the last value persisted (written, or read back with
+      `mark_persisted`) are dropped without a write.
+    - Pending upserts are flushed in batches of `batch_size` once `window` seconds have
+      passed since the first of them, once `max_pending` keys are pending, or when
+      `flush` is called (callers that must read their own writes flush explicitly).
+
+    `write` receives a list of items and returns True if all of them were stored.
+    """
+    def __init__(self, name: str, write: Callable[[List[dict]], bool], key_fields: Tuple[str, ...],
+                 window: float = None, batch_size: int = 100, max_pending: int = 1000,
+                 max_persisted: int = 100000):
+        self.name = name
+        self.write = write
+        self.key_fields = key_fields
+        self.window = window if window is not None else float(os.environ.get('COINTRACKER_WRITE_WINDOW', 0.5))
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_persisted = max_persisted
+        self._pending: 'OrderedDict[Hashable, dict]' = OrderedDict()
+        self._persisted: 'OrderedDict[Hashable, tuple]' = OrderedDict()  # key -> fingerprint of the stored value
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time, so flushes never race on a key
+        self._timer: Optional[threading.Timer] = None
+
+    def key(self, item: dict) -> Hashable:
+        return tuple(item[field] for field in self.key_fields)
+
+    @staticmethod
+    def fingerprint(item: dict) -> tuple:
+        return tuple(sorted((name, _normalize(value)) for name, value in item.items()))
+
+    def _remember(self, key: Hashable, fingerprint: tuple) -> None:
+        self._persisted[key] = fingerprint
+        self._persisted.move_to_end(key)
+        while len(self._persisted) > self.max_persisted:
+            self._persisted.popitem(last=False)
+
+    def mark_persisted(self, items: Iterable[dict]) -> None:
+        """
+        Record items read back from the table as the persisted version of their keys.
+        """
+        with self._lock:
+            for item in items:
+                self._remember(self.key(item), self.fingerprint(item))
+
+    def forget(self, keys: Iterable[Hashable]) -> None:
+        """
+        Drop what is known about the stored value of keys (e.g. after deleting their rows),
+        so the next upsert of each is written.
+        """
+        with self._lock:
+            for key in keys:
+                self._persisted.pop(key, None)
+
+    def is_persisted(self, items: Iterable[dict]) -> bool:
+        """
+        Whether every item is stored as given (written by a flush or already identical).
+        """
+        with self._lock:
+            return all(self._persisted.get(self.key(item)) == self.fingerprint(item) for item in items)
+
+    def put(self, item: dict) -> bool:
+        """
+        Queue an upsert of item.
+
+        Returns:
+            False if the write was skipped because the stored value is identical, else True.
+        """
+        key, fingerprint = self.key(item), self.fingerprint(item)
+        with self._lock:
+            if self._persisted.get(key) == fingerprint:
+                self._pending.pop(key, None)  # a pending change was reverted; nothing to write
+                metrics.COALESCED_WRITES.inc(table=self.name, result='skipped')
+                return False
+            if key in self._pending:
+                metrics.COALESCED_WRITES.inc(table=self.name, result='collapsed')
+            self._pending[key] = item
+            flush_now = self.window <= 0 or len(self._pending) >= self.max_pending
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+        return True
+
+    def put_many(self, items: Iterable[dict]) -> int:
+        """
+        Queue many upserts; returns how many were not skipped.
+        """
+        return sum(self.put(item) for item in items)
+
+    def flush(self) -> bool:
+        """
+        Write every pending upsert now.
+
+        Returns:
+            True if every batch was written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._pending.values())
+                self._pending.clear()
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            ok = True
+            for i in range(0, len(items), self.batch_size):
+                batch = items[i:i + self.batch_size]
+                try:
+                    written = self.write(batch)
+                except Exception as e:
+                    logger.error("Coalesced write of %s items to '%s' failed: %s", len(batch), self.name, e)
+                    written = False
+                with self._lock:
+                    for item in batch:
+                        if written:
+                            self._remember(self.key(item), self.fingerprint(item))
+                        else:
+                            self._persisted.pop(self.key(item), None)  # stored state unknown
+                metrics.COALESCED_WRITES.inc(len(batch), table=self.name, result='written' if written else 'failed')
+                ok = ok and written
+            return ok
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -1,23 +1,33 @@
 # database.py
-from typing import List, Any
-import boto3
-from boto3.dynamodb.conditions import Key
+from typing import List, Any, Iterator, Optional, Tuple
+import logging
+from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime, timezone
 from blockchain_com_api import BlockChainAPI
 from decimal import Decimal
-import hashlib
+from auth import get_hasher
+from ddb_client import get_client, projection_expression
+from storage import BTCBalancesStore, TransactionsStore, UserAddressesStore, UsersStore
+
+logger = logging.getLogger(__name__)
 
 # Create Tables
 class DDBTable:
-    def __init__(self, table_name: str, partition_key: str):
-        self.client = boto3.resource('dynamodb', region_name='us-east-1')
+    def __init__(self, table_name: str, partition_key: str, sort_key: str = None, billing_mode: str = None,
+                 read_capacity: int = None, write_capacity: int = None):
+        self.ddb = get_client()
+        self.client = self.ddb.resource
         self.table_name = table_name
         self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.billing_mode = billing_mode
+        self.read_capacity = read_capacity
+        self.write_capacity = write_capacity
 
         if not self.table_exists(self.table_name):
             self.create_table(self.table_name, self.partition_key)
         else:
-            print(f"Table '{self.table_name}' already exists.")
+            logger.info("Table '%s' already exists.", self.table_name)
 
     def table_exists(self, table_name: str) -> bool:
         """
@@ -38,6 +48,7 @@ class DDBTable:
     def create_table(self, table_name: str, partition_key: str) -> None:
         """
         Create DDB table.
+        Capacity is on-demand (PAY_PER_REQUEST) or provisioned, see DynamoDBClient.create_table.
 
         Args:
             table_name: name of the new table.
@@ -45,67 +56,73 @@ class DDBTable:
         Returns:
             Create new table in DynamoDB.
         """
+        key_schema = [
+            {
+                'AttributeName': partition_key,
+                'KeyType': 'HASH' # Partition key
+            }
+        ]
+        attribute_definitions = [
+            {
+                'AttributeName': partition_key,
+                'AttributeType': 'S' # string
+            },
+        ]
+        if self.sort_key:
+            key_schema.append({'AttributeName': self.sort_key, 'KeyType': 'RANGE'}) # Sort key
+            attribute_definitions.append({'AttributeName': self.sort_key, 'AttributeType': 'S'})
         try:
-            response = self.client.create_table(
-                TableName=table_name,
-                KeySchema=[
-                    {
-                        'AttributeName': partition_key,
-                        'KeyType': 'HASH' # Partition key
-                    }
-                ],
-                AttributeDefinitions=[
-                    {
-                        'AttributeName': partition_key,
-                        'AttributeType': 'S' # string
-                    },
-                    # 
-                ],
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': 10,  # Adjust based on your read requirements
-                    'WriteCapacityUnits': 10  # Adjust based on your write requirements
-                }
+            response = self.ddb.create_table(
+                table_name,
+                key_schema=key_schema,
+                attribute_definitions=attribute_definitions,
+                billing_mode=self.billing_mode,
+                read_capacity=self.read_capacity,
+                write_capacity=self.write_capacity,
             )
-            print(f"Table {self.table_name} created successfully!")
+            logger.info("Table %s created successfully!", self.table_name)
         except Exception as e:
-            print(f"Error creating table: {e}")
+            logger.error("Error creating table: %s", e)
 
 
 # UsersDB
-class UsersDB(DDBTable):
+class UsersDB(DDBTable, UsersStore):
     def __init__(self):
-        self.client = boto3.resource('dynamodb', region_name='us-east-1')
+        self.ddb = get_client()
         self.table_name = 'users'
-        self.table = self.client.Table(self.table_name)
-        print(f"DDB table '{self.table_name}' succesfully initialized.")
+        self.table = self.ddb.table(self.table_name)
+        logger.debug("DDB table '%s' succesfully initialized.", self.table_name)
 
     def add_user(self, username: str, password: str) -> bool:
         """
         Adds a new username if it does not exist.
+        Only a salted scrypt hash of the password is stored.
         Args:
             username: a new username in str format.
             password: a password corresponding to the username.
 
         Returns:
-            True if add_user operation succesful else False.
+            True if add_user operation succesful else False (including if username exists).
         """
         created_time_utc = datetime.now(timezone.utc).isoformat()
         try:
-            encrypted_password = password.encode('utf-8')
-            encrypted_password = hashlib.sha256(encrypted_password).hexdigest()
+            password_hash = get_hasher().hash_password(password)
 
-            self.table.put_item(
+            self.ddb.request(self.table, 'put_item',
                 Item={
                     'username': username,
-                    'password': password,
-                    'encrypted_password': encrypted_password,
+                    'password_hash': password_hash,
                     'time_registered': created_time_utc,
-                }
+                },
+                ConditionExpression=Attr('username').not_exists(),  # never overwrite an account
             )
-            print(f"User '{username}' succesfully added to the database.")
+            logger.info("User '%s' succesfully added to the database.", username)
             return True
+        except self.ddb.resource.meta.client.exceptions.ConditionalCheckFailedException:
+            logger.info("Username '%s' already exists.", username)
+            return False
         except Exception as e:
-            print(f"Failed to add user '{username}': {e}")
+            logger.error("Failed to add user '%s': %s", username, e)
             return False
     
     def get_user(self, username: str) -> dict:  
@@ -117,7 +134,7 @@ class UsersDB(DDBTable):
             dictionary with username information
         """     
         try:
-            response = self.table.get_item(
+            response = self.ddb.request(self.table, 'get_item',
                 Key={
                     'username': username
                 }
@@ -127,19 +144,103 @@ class UsersDB(DDBTable):
             else:
                 return None
         except Exception as e:
-            print(f"Error attempting to retrieve username '{username}: {e}")
+            logger.error("Error attempting to retrieve username '%s': %s", username, e)
             return None
 
+    def set_password_hash(self, username: str, password_hash: str) -> bool:
+        """
+        Replace the stored credentials of username with password_hash, dropping any
+        plaintext or unsalted password left by older versions.
+        Returns:
+            True if operation succesful else False.
+        """
+        try:
+            self.ddb.request(self.table, 'update_item',
+                Key={'username': username},
+                UpdateExpression='SET password_hash = :password_hash REMOVE password, encrypted_password',
+                ExpressionAttributeValues={':password_hash': password_hash},
+            )
+            return True
+        except Exception as e:
+            logger.error("Failed to update password of username '%s': %s", username, e)
+            return False
+
+# UserAddressesDB
+class UserAddressesDB(UserAddressesStore):
+    """
+    Which user tracks which BTC address (one row per subscription).
+    Address data itself (balance, transactions, sync state) is shared and stored once.
+    """
+    def __init__(self):
+        self.ddb = get_client()
+        self.table_name = 'user_addresses'
+        self.table = self.ddb.table(self.table_name)
+        logger.debug("User addresses table '%s' succesfully initialized.", self.table_name)
+
+    def add_address(self, username: str, btc_address: str) -> bool:
+        """
+        Link btc_address to username.
+
+        Returns:
+            True if the link was created, False if the user already tracks the address.
+        """
+        try:
+            self.ddb.request(self.table, 'put_item',
+                Item={
+                    'username': username,
+                    'btc_address': btc_address,
+                    'time_added': datetime.now(timezone.utc).isoformat(),
+                },
+                ConditionExpression=Attr('btc_address').not_exists(),
+            )
+            return True
+        except self.ddb.resource.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def remove_address(self, username: str, btc_address: str) -> bool:
+        """
+        Unlink btc_address from username.
+
+        Returns:
+            True if the link existed and was removed, False otherwise.
+        """
+        try:
+            self.ddb.request(self.table, 'delete_item',
+                Key={'username': username, 'btc_address': btc_address},
+                ConditionExpression=Attr('btc_address').exists(),
+            )
+            return True
+        except self.ddb.resource.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def get_btc_addresses_for_user(self, username: str) -> set:
+        """
+        Query (not scan) every BTC address linked to username.
+        """
+        btc_addresses = set()
+        kwargs = {'KeyConditionExpression': Key('username').eq(username), **projection_expression(['btc_address'])}
+        while True:
+            response = self.ddb.request(self.table, 'query', **kwargs)
+            btc_addresses.update(item['btc_address'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return btc_addresses
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
 # BTCBalancesDB 
-class BTCBalancesDB:
+class BTCBalancesDB(BTCBalancesStore):
+    """
+    Shared per-address data (balance, sync state, number of subscribers), keyed by btc_address.
+    """
     def __init__(self):
-        self.client = boto3.resource('dynamodb', region_name='us-east-1')
+        self.ddb = get_client()
         self.table_name = 'btc_balances'
-        self.table = self.client.Table(self.table_name)
-        print(f"BTC database table '{self.table_name}' succesfully initialized.")
+        self.table = self.ddb.table(self.table_name)
+        logger.debug("BTC database table '%s' succesfully initialized.", self.table_name)
         self.blockchain_api = BlockChainAPI()
-        
-    # TODO: Finish this table
+        self.user_addresses_db = UserAddressesDB()
+        self.transactions_db = TransactionsDB()
+
     def get_table(self) -> List[dict]:
         """
         Get BTC DynamoDB Table.
@@ -147,158 +248,395 @@ class BTCBalancesDB:
             A list of dictionary containing elements in the BTC table.
         """
         try:
-            response = self.table.scan()
-            items = response.get('Items', [])
+            items = []
+            for page in self.iter_pages():
+                items.extend(page)
             return items
-            # while 'LastEvaluatedKey' in response:
-            #     response = self.table.scan(ExclusveStartKey=response['LastEvaluatedKey'])
-            #     items = response.get('Items', [])
-            #     for item in items:
-            #         print(item)
         except Exception as e:
-            print(f"Failed to obtain table {self.table.name}: {e}")
+            logger.error("Failed to obtain table %s: %s", self.table.name, e)
+            return []
+
+    def iter_pages(self, projection: List[str] = None, total_segments: int = 4) -> Iterator[List[dict]]:
+        """
+        Stream the whole BTC Balances table with a parallel segmented scan.
+
+        Args:
+            projection: attribute names to fetch, e.g. ['btc_address']; all if None.
+            total_segments: number of segments scanned concurrently.
+
+        Returns:
+            A generator of pages (lists of items).
+        """
+        return self.ddb.parallel_scan(self.table, total_segments=total_segments, projection=projection)
+
+    def get_item(self, btc_address: str) -> dict:
+        """
+        Shared data for btc_address, or None if no user tracks it.
+        """
+        try:
+            response = self.ddb.request(self.table, 'get_item', Key={'btc_address': btc_address})
+            return response.get('Item')
+        except Exception as e:
+            logger.error("Failed to get btc_address '%s': %s", btc_address, e)
+            return None
 
     def add_item(self, btc_address: str, username: str) -> bool:
         """
-        Adds an entry to the BTC Balances table.
+        Adds btc_address to the BTC Balances table (once, shared by every user) and links it to username.
+        The address is only validated and its balance fetched the first time anyone tracks it.
 
         Args:
             btc_address: a valid bitcoin address in str format.
-            username: a valid username in int format.
+            username: a valid username in str format.
 
         Returns:
             True if operation succesful else False.
         """
         created_time_utc = datetime.now(timezone.utc).isoformat()
         try:
-            if self.blockchain_api.valid_btc_address(btc_address): # check that it is a valid BTC address
+            if self.get_item(btc_address) is None:
+                if not self.blockchain_api.valid_btc_address(btc_address): # check that it is a valid BTC address
+                    return False
                 btc_balance = self.blockchain_api.get_balance(btc_address)
                 if not btc_balance: btc_balance = 0
-                self.table.put_item(
-                    Item={
-                        'btc_address': btc_address,
-                        'username': username,
-                        'time_added': created_time_utc,
-                        'btc_balance': btc_balance, #Decimal(btc_balance),
-                    }
+                try:
+                    self.ddb.request(self.table, 'put_item',
+                        Item={
+                            'btc_address': btc_address,
+                            'time_added': created_time_utc,
+                            'btc_balance': btc_balance,
+                            'subscribers': 0,
+                        },
+                        ConditionExpression=Attr('btc_address').not_exists(),
+                    )
+                except self.ddb.resource.meta.client.exceptions.ConditionalCheckFailedException:
+                    pass  # another user added it concurrently
+
+            if self.user_addresses_db.add_address(username, btc_address):
+                self.ddb.request(self.table, 'update_item',
+                    Key={'btc_address': btc_address},
+                    UpdateExpression='ADD subscribers :one',
+                    ExpressionAttributeValues={':one': 1},
                 )
-                print(f"Item with btc_address '{btc_address}' added succesfully to the '{self.table_name}' DB.")
-                return True
+            logger.info("btc_address '%s' linked to username '%s'.", btc_address, username)
+            return True
         except Exception as e:
-            print(f"Failed to add btc_address '{btc_address}': {e}")
+            logger.error("Failed to add btc_address '%s': %s", btc_address, e)
             return False
 
-    def remove_item(self, btc_address: str) -> bool:
+    def remove_item(self, btc_address: str, username: str) -> bool:
         """
-        Removes an entry to the BTCBalances table.
+        Unlinks btc_address from username. The shared address data and its transactions
+        are deleted once no user tracks the address anymore.
         
         Args:
-            btc_address: a valid bitcoin address in str format.
+            btc_address: a bitcoin address in str format.
+            username: the user that tracks btc_address.
 
         Returns:
             True if operation succesful else False.
         """
         try:
-            if self.blockchain_api.valid_btc_address(btc_address):
-                response = self.table.delete_item(
-                    Key={
-                        'btc_address':btc_address
-                    }
-                )
+            if not self.user_addresses_db.remove_address(username, btc_address):
+                logger.warning("Username '%s' does not track btc_address '%s'.", username, btc_address)
+                return False
 
-                if response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 200:
-                    print(f"Item with btc_address '{btc_address}' removed successfully from '{self.table_name}' DB.")
-                    return True
-                else: 
-                    print(f"Failed to remove item with btc_address '{btc_address}'. Unexpected response.")
-                    return False
+            response = self.ddb.request(self.table, 'update_item',
+                Key={'btc_address': btc_address},
+                UpdateExpression='ADD subscribers :minus_one',
+                ExpressionAttributeValues={':minus_one': -1},
+                ReturnValues='UPDATED_NEW',
+            )
+            if response.get('Attributes', {}).get('subscribers', 0) <= 0:
+                try:
+                    self.ddb.request(self.table, 'delete_item',
+                        Key={'btc_address': btc_address},
+                        ConditionExpression=Attr('subscribers').lte(0),
+                    )
+                    self.transactions_db.remove_transactions(btc_address)
+                except self.ddb.resource.meta.client.exceptions.ConditionalCheckFailedException:
+                    pass  # re-added concurrently
+            logger.info("btc_address '%s' unlinked from username '%s'.", btc_address, username)
+            return True
         except Exception as e:
-            print("Failed to remove item with btc_address '{btc_address}' : {e}")
+            logger.error("Failed to remove item with btc_address '%s' : %s", btc_address, e)
             return False
-        
-    def get_btc_addresses_for_user(self, username: int) -> set:
+
+    def link_legacy_owner(self, btc_address: str, username: str) -> bool:
+        """
+        Move the owner stored by versions before user_addresses (the `username` attribute
+        of the address row) to a user_addresses link and count it in `subscribers`. The link
+        and the count are written in one transaction, so the backfill can be re-run safely.
+
+        Args:
+            btc_address: a bitcoin address whose row still has a `username` attribute.
+            username: the value of that attribute.
+
+        Returns:
+            True if the row was migrated, False if it had been migrated already.
+        """
+        client = self.ddb.resource.meta.client  # takes plain Python values, like the Table resource
+        update = {
+            'TableName': self.table_name,
+            'Key': {'btc_address': btc_address},
+            'ConditionExpression': 'username = :username',
+        }
+        try:
+            self.ddb.request(client, 'transact_write_items', metrics_table=self.table_name, TransactItems=[
+                {'Put': {
+                    'TableName': self.user_addresses_db.table_name,
+                    'Item': {'username': username, 'btc_address': btc_address,
+                             'time_added': datetime.now(timezone.utc).isoformat()},
+                    'ConditionExpression': 'attribute_not_exists(btc_address)',
+                }},
+                {'Update': dict(update, UpdateExpression='ADD subscribers :one REMOVE username',
+                                ExpressionAttributeValues={':one': 1, ':username': username})},
+            ])
+            return True
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if reasons[1:2] == ['ConditionalCheckFailed']:
+                return False  # username already removed by an earlier run
+            if reasons[:1] != ['ConditionalCheckFailed']:
+                raise
+            # the owner re-added the address since the upgrade, so the link is counted already
+            self.ddb.request(client, 'update_item', metrics_table=self.table_name,
+                             **dict(update, UpdateExpression='REMOVE username',
+                                    ExpressionAttributeValues={':username': username}))
+            return True
+
+    def update_balance(self, btc_address: str, btc_balance: int) -> bool:
+        """
+        Store a freshly fetched balance for an existing btc_address.
+
+        Args:
+            btc_address: a tracked bitcoin address in str format.
+            btc_balance: the current balance in satoshi.
+
+        Returns:
+            True if operation succesful else False.
+        """
+        refreshed_time_utc = datetime.now(timezone.utc).isoformat()
+        try:
+            self.ddb.request(self.table, 'update_item',
+                Key={'btc_address': btc_address},
+                UpdateExpression='SET btc_balance = :balance, time_refreshed = :refreshed',
+                ConditionExpression=Attr('btc_address').exists(),
+                ExpressionAttributeValues={':balance': btc_balance, ':refreshed': refreshed_time_utc},
+            )
+            return True
+        except Exception as e:
+            logger.error("Failed to update balance for btc_address '%s': %s", btc_address, e)
+            return False
+
+    def get_items(self, btc_addresses: List[str]) -> dict:
+        """
+        Shared data for many addresses at once (BatchGetItem).
+
+        Returns:
+            {btc_address: item} for every tracked address in btc_addresses.
+        """
+        try:
+            keys = [{'btc_address': btc_address} for btc_address in dict.fromkeys(btc_addresses)]
+            return {item['btc_address']: item for item in self.ddb.batch_get(self.table, keys)}
+        except Exception as e:
+            logger.error("Failed to get btc_addresses %s: %s", btc_addresses, e)
+            return {}
+
+    def mark_synced(self, btc_address: str, n_tx: int, btc_balance: int = None,
+                    last_tx_height: int = None, synced_height: int = None) -> bool:
+        """
+        Record the sync state of btc_address, used to skip re-syncing unchanged addresses.
+
+        Args:
+            btc_address: a tracked bitcoin address in str format.
+            n_tx: number of transactions of the address when synced.
+            btc_balance: final balance in satoshi when synced.
+            last_tx_height: block height of the latest transaction (None if unconfirmed).
+            synced_height: chain tip height when synced.
+
+        Returns:
+            True if operation succesful else False.
+        """
+        synced_time_utc = datetime.now(timezone.utc).isoformat()
+        update = 'SET time_synced = :synced, n_tx = :n_tx, last_tx_height = :last_tx_height, synced_height = :synced_height'
+        values = {':synced': synced_time_utc, ':n_tx': n_tx,
+                  ':last_tx_height': last_tx_height, ':synced_height': synced_height}
+        if btc_balance is not None:
+            update += ', btc_balance = :balance'
+            values[':balance'] = btc_balance
+        try:
+            self.ddb.request(self.table, 'update_item',
+                Key={'btc_address': btc_address},
+                UpdateExpression=update,
+                ConditionExpression=Attr('btc_address').exists(),
+                ExpressionAttributeValues=values,
+            )
+            return True
+        except Exception as e:
+            logger.error("Failed to mark btc_address '%s' as synced: %s", btc_address, e)
+            return False
+
+    def get_btc_addresses_for_user(self, username: str) -> set:
         """Fetches BTC Addresses linked with a user id
         
         Args:
-            username: a valid username in int format
+            username: a valid username in str format
 
         Returns:
             A set of all the BTC addresses linked to the username input.
         """
         try:
-            response = self.table.scan()
-            btc_addreses = set()
-            for item in response['Items']:
-                if 'username' in item and item['username'] == username:
-                    btc_addr = item['btc_address']
-                    btc_addreses.add(btc_addr)
-            print(f"All btc_address associated with username '{username}': \n '{btc_addreses}'")
+            btc_addreses = self.user_addresses_db.get_btc_addresses_for_user(username)
+            logger.debug("All btc_address associated with username '%s': %s", username, btc_addreses)
             return btc_addreses
         except Exception as e:
-            print(f"Failed to retrieve btc addresses for username '{username}': {e}")
-            return []
+            logger.error("Failed to retrieve btc addresses for username '%s': %s", username, e)
+            return set()
 
 
 # TransactionsDB
-class TransactionsDB:
+class TransactionsDB(TransactionsStore):
+    """
+    Transaction history per BTC address, shared by every user tracking it.
+    Keyed by btc_address (partition) and tx_key = '<time>#<tx hash>' (sort), so a Query
+    returns an address's transactions in time order.
+    """
     def __init__(self):
-        self.client = boto3.resource('dynamodb', region_name='us-east-1')
-        self.table_name = 'transactions'
-        self.table = self.client.Table(self.table_name)
-        print(f"Transactions database table '{self.table_name}' succesfully initialized.")
-        self.blockchain_api = BlockChainAPI()
+        self.ddb = get_client()
+        self.table_name = 'address_transactions'
+        self.table = self.ddb.table(self.table_name)
+        logger.debug("Transactions database table '%s' succesfully initialized.", self.table_name)
 
-    def add_transaction(self, username: str, ith: int, btc_address: str, timestamp: int, fee: int, balance: int) -> bool:
-        """Adds an entry to the BTC table.
+    def add_transaction(self, btc_address: str, tx_hash: str, timestamp: int, fee: int, balance: int) -> bool:
+        """Adds an entry to the Transactions table.
 
         Args:
             btc_address: a valid bitcoin address in str format.
-            username: a valid username in int format.
+            tx_hash: the transaction hash.
+            timestamp: unix time of the transaction.
+            fee: transaction fee in satoshi.
+            balance: address balance after the transaction in satoshi.
 
         Returns:
             True if operation succesful else False.
         """
         try:
-            # unique identifier - partition key
-            modified_btc_address = username + str(ith) + btc_address
-            print(f"Modified btc address: '{modified_btc_address}'.")
-
-            # modify time
-            utc_datetime = datetime.utcfromtimestamp(timestamp)
-            utc_datetime_str = utc_datetime.strftime('%Y-%m-%d %H:%M:%S')
-            
-            self.table.put_item(
-                Item={
-                    'modified_btc_address': modified_btc_address,
-                    'btc_address': btc_address,
-                    'time': utc_datetime_str,
-                    'balance': balance,
-                    'fee': fee,
-                }
-            )
-            print(f"Item with btc_address '{btc_address}' added succesfully to '{self.table_name}' DB.")
+            item = self.to_item(btc_address, tx_hash, timestamp, fee, balance)
+            self.ddb.request(self.table, 'put_item', Item=item)
+            logger.debug("Item '%s' added succesfully to '%s' DB.", item['tx_key'], self.table_name)
+            return True
+        except Exception as e:
+            logger.error("Failed to add transaction btc_address %s: %s", btc_address, e)
+            return False
+
+    def add_transactions(self, items: List[dict]) -> bool:
+        """Adds many items built with `to_item` using batch writes.
+
+        Returns:
+            True if operation succesful else False.
+        """
+        try:
+            self.ddb.batch_write(self.table, put_items=items)
             return True
         except Exception as e:
-            print(f"Failed to add transaction btc_address {btc_address}: {e}")
+            logger.error("Failed to add %s transactions: %s", len(items), e)
+            return False
+
+    def remove_transaction_keys(self, keys: List[dict]) -> bool:
+        """Deletes the given {btc_address, tx_key} keys using batch writes.
+
+        Returns:
+            True if operation succesful else False.
+        """
+        try:
+            self.ddb.batch_write(self.table, delete_keys=keys)
+            return True
+        except Exception as e:
+            logger.error("Failed to remove %s transactions: %s", len(keys), e)
+            return False
+
+    def remove_transactions(self, btc_address: str) -> bool:
+        """Deletes every stored transaction of btc_address.
+
+        Returns:
+            True if operation succesful else False.
+        """
+        try:
+            kwargs = {'KeyConditionExpression': Key('btc_address').eq(btc_address),
+                      **projection_expression(['btc_address', 'tx_key'])}
+            while True:
+                response = self.ddb.request(self.table, 'query', **kwargs)
+                self.ddb.batch_write(self.table, delete_keys=response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    return True
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            logger.error("Failed to remove transactions of btc_address %s: %s", btc_address, e)
             return False
         
+    def get_page(self, btc_address: str, page_size: int = 20, cursor: str = None) -> Tuple[List[dict], Optional[str]]:
+        """Get one page of btc_address's transactions, latest first.
+
+        Args:
+            btc_address: a tracked bitcoin address in str format.
+            page_size: maximum number of transactions on the page.
+            cursor: tx_key of the last transaction on the previous page (None for the first page).
+
+        Returns:
+            (transactions, cursor of the next page or None on the last page).
+        """
+        kwargs = {
+            'KeyConditionExpression': Key('btc_address').eq(btc_address),
+            'ScanIndexForward': False,  # latest first
+            # One extra row tells whether another page follows: LastEvaluatedKey is returned
+            # whenever Limit is reached, even if no rows are left.
+            'Limit': page_size + 1,
+        }
+        if cursor:
+            kwargs['ExclusiveStartKey'] = {'btc_address': btc_address, 'tx_key': cursor}
+        try:
+            response = self.ddb.request(self.table, 'query', **kwargs)
+            items = response.get('Items', [])
+            next_cursor = items[page_size - 1]['tx_key'] if len(items) > page_size else None
+            return items[:page_size], next_cursor
+        except Exception as e:
+            logger.error("Failed to obtain page of table %s: %s", self.table_name, e)
+            return [], None
+
     def get_table(self, btc_address: str, num_of_items:int = 20) -> List[dict] :
-        """Get BTC DynamoDB Table
+        """Get the latest transactions of btc_address
         Returns:
-            A list of dictionary containing elements in the BTC table.
+            A list of dictionary containing up to num_of_items transactions, latest first.
         """
         try:
-            response = self.table.scan(
-                FilterExpression=Key('btc_address').eq(btc_address)
+            response = self.ddb.request(self.table, 'query',
+                KeyConditionExpression=Key('btc_address').eq(btc_address),
+                ScanIndexForward=False,  # latest first
+                Limit=num_of_items,
             )
-            items = response.get('Items', [])
-            len_items = len(items)
-            print(len_items)       
-            len_items = min(len_items, num_of_items)
-            print(len_items)
-            return items[:len_items]
+            return response.get('Items', [])
+        except Exception as e:
+            logger.error("Failed to obtain table %s: %s", self.table_name, e)
+            return []
+
+    def get_history(self, btc_address: str) -> List[dict]:
+        """Get the timestamp, balance and fee of every stored transaction of btc_address
+        Returns:
+            A list of dictionaries, oldest first.
+        """
+        history = []
+        kwargs = {'KeyConditionExpression': Key('btc_address').eq(btc_address),
+                  **projection_expression(['timestamp', 'balance', 'fee'])}
+        try:
+            while True:
+                response = self.ddb.request(self.table, 'query', **kwargs)
+                history.extend(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    return history
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
         except Exception as e:
-            print(f"Failed to obtain table {self.table_name}: {e}")
+            logger.error("Failed to obtain history of btc_address %s: %s", btc_address, e)
             return []
         
 def main():
@@ -308,23 +646,25 @@ def main():
     # Create 'users' DDB table
     table_name = 'users'
     partition_key = 'username'
-    print("\n")
-    print(DDBTable(table_name, partition_key))
-    print("\n")
+    DDBTable(table_name, partition_key)
 
-    # Create 'btc_balances' DDB table
+    # Create 'btc_balances' DDB table (shared per-address data)
     table_name = 'btc_balances'
     partition_key = 'btc_address'
-    print("\n")
-    print(DDBTable(table_name, partition_key))
-    print("\n")
+    DDBTable(table_name, partition_key)
 
-    # Create 'transactions' DDB table
-    table_name = 'transactions'
-    partition_key = 'modified_btc_address'
-    print("\n")
-    print(DDBTable(table_name, partition_key))
-    print("\n")
+    # Create 'user_addresses' DDB table (user -> address ownership)
+    table_name = 'user_addresses'
+    partition_key = 'username'
+    sort_key = 'btc_address'
+    DDBTable(table_name, partition_key, sort_key)
+
+    # Create 'address_transactions' DDB table (shared per-address history)
+    table_name = 'address_transactions'
+    partition_key = 'btc_address'
+    sort_key = 'tx_key'
+    DDBTable(table_name, partition_key, sort_key)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     main()
\ No newline at end of file
@@ -0,0 +1,375 @@
+# ddb_client.py
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REGION_NAME = 'us-east-1'
+
+# Error codes DynamoDB returns when a table or account is over its capacity.
+THROTTLING_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+}
+
+# Error codes for transient service-side failures, retried with the same backoff (without
+# lowering the request rate). Any other 5xx response and connection failures are retried too.
+TRANSIENT_ERRORS = {
+    'InternalServerError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+}
+
+BILLING_MODE_PROVISIONED = 'PROVISIONED'
+BILLING_MODE_PAY_PER_REQUEST = 'PAY_PER_REQUEST'
+
+
+def projection_expression(attributes: Iterable[str]) -> dict:
+    """
+    Build ProjectionExpression kwargs for `attributes`, aliasing names so reserved words like 'time' work.
+    """
+    names = {f'#p{i}': attribute for i, attribute in enumerate(attributes)}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names,
+    }
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side token bucket that only engages once a table starts throttling.
+
+    Until the first throttle requests go straight through. A throttle caps the rate at
+    `throttled_rate` requests/s (or multiplies the current cap by `decrease`); every success
+    raises the cap by `increase` until it reaches `max_rate` and the limiter disengages
+    again (additive increase, multiplicative decrease).
+    """
+    def __init__(self, throttled_rate: float = 50.0, min_rate: float = 1.0, max_rate: float = 1000.0,
+                 increase: float = 1.0, decrease: float = 0.5):
+        self.rate: Optional[float] = None  # None = not limiting
+        self.throttled_rate = throttled_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be sent. Returns the time spent waiting in seconds.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                if self.rate is None:
+                    return waited
+                now = time.monotonic()
+                self._tokens = min(1.0, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return waited
+                delay = (1.0 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self.rate is not None:
+                self.rate += self.increase
+                if self.rate >= self.max_rate:
+                    self.rate = None
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            if self.rate is None:
+                self.rate = self.throttled_rate
+                self._tokens = 0.0
+                self._last = time.monotonic()
+            else:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+class DynamoDBClient:
+    """
+    Shared DynamoDB access layer.
+
+    Every table operation goes through `request`, which rate limits per table, retries
+    throttled and transiently failed calls with full-jitter exponential backoff and records
+    latency, consumed capacity and item counts in `metrics`. SDK retries are disabled so
+    retries are handled (and visible) here only.
+    """
+    def __init__(self, region_name: str = REGION_NAME, max_attempts: int = 8, base_delay: float = 0.05,
+                 max_delay: float = 5.0, throttled_rate: float = 50.0):
+        config = Config(retries={'total_max_attempts': 1, 'mode': 'standard'})
+        self.resource = boto3.resource('dynamodb', region_name=region_name, config=config)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled_rate = throttled_rate
+        self._limiters: Dict[str, AdaptiveRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def table(self, table_name: str):
+        return self.resource.Table(table_name)
+
+    def limiter(self, table_name: str) -> AdaptiveRateLimiter:
+        with self._lock:
+            limiter = self._limiters.get(table_name)
+            if limiter is None:
+                limiter = self._limiters[table_name] = AdaptiveRateLimiter(throttled_rate=self.throttled_rate)
+            return limiter
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter delay before retry number `attempt` (1-based).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        """
+        Whether error is a retryable service or network failure (other than throttling).
+        """
+        if isinstance(error, (BotoConnectionError, ReadTimeoutError)):
+            return True
+        response = getattr(error, 'response', {})
+        return response.get('Error', {}).get('Code') in TRANSIENT_ERRORS or \
+            response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+    def request(self, table, operation: str, metrics_table: str = None, **kwargs) -> dict:
+        """
+        Run a DynamoDB table operation with rate limiting and retries on throttling and transient errors.
+
+        Args:
+            table: boto3 DynamoDB Table resource (or the service resource for batch operations).
+            operation: Table method name, e.g. 'put_item', 'get_item', 'scan' or 'query'.
+            metrics_table: table name used for rate limiting and metrics; defaults to `table.name`.
+            kwargs: arguments passed through to the operation.
+
+        Returns:
+            The raw DynamoDB response.
+
+        Raises:
+            ClientError: if the call fails for a reason other than throttling or a transient
+            error, or still fails after `max_attempts` attempts (connection errors are
+            re-raised the same way).
+        """
+        kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        table_name = metrics_table or table.name
+        limiter = self.limiter(table_name)
+        attempt = 0
+        while True:
+            attempt += 1
+            limiter.acquire()
+            status = 'error'
+            try:
+                with metrics.timer(metrics.DDB_LATENCY, table=table_name, operation=operation):
+                    response = getattr(table, operation)(**kwargs)
+                status = 'ok'
+            except (ClientError, BotoConnectionError, ReadTimeoutError) as e:
+                throttled = isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+                if not throttled and not self.is_transient(e):
+                    raise
+                if throttled:
+                    status = 'throttled'
+                    limiter.on_throttle()
+                reason = 'throttled' if throttled else f'failed ({e})'
+                if attempt >= self.max_attempts:
+                    logger.error("DynamoDB %s on '%s' still %s after %s attempts.",
+                                 operation, table_name, reason, attempt)
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning("DynamoDB %s on '%s' %s (attempt %s); retrying in %.2fs, limited to %s req/s.",
+                               operation, table_name, reason, attempt, delay, limiter.rate)
+                time.sleep(delay)
+                continue
+            finally:
+                metrics.DDB_OPERATIONS.inc(table=table_name, operation=operation, status=status)
+            limiter.on_success()
+            metrics.record_ddb_response(table_name, operation, response)
+            return response
+
+    def batch_write(self, table, put_items: List[dict] = (), delete_keys: List[dict] = ()) -> None:
+        """
+        Write items and delete keys in BatchWriteItem calls of up to 25 requests.
+
+        Unprocessed items (partial throttling) are retried with the same jittered backoff and
+        rate limiting as throttled single-item calls.
+
+        Raises:
+            ClientError: if items are still unprocessed after `max_attempts` attempts.
+        """
+        requests = [{'PutRequest': {'Item': item}} for item in put_items]
+        requests += [{'DeleteRequest': {'Key': key}} for key in delete_keys]
+        limiter = self.limiter(table.name)
+        for start in range(0, len(requests), 25):
+            batch = requests[start:start + 25]
+            attempt = 0
+            while batch:
+                attempt += 1
+                response = self.request(self.resource, 'batch_write_item', metrics_table=table.name,
+                                        RequestItems={table.name: batch})
+                batch = response.get('UnprocessedItems', {}).get(table.name, [])
+                if not batch:
+                    break
+                limiter.on_throttle()
+                if attempt >= self.max_attempts:
+                    raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException',
+                                                 'Message': f'{len(batch)} items unprocessed'}}, 'BatchWriteItem')
+                time.sleep(self.backoff(attempt))
+
+    def batch_get(self, table, keys: List[dict], projection: Iterable[str] = None) -> List[dict]:
+        """
+        Fetch many items by key in BatchGetItem calls of up to 100 keys, retrying unprocessed keys.
+
+        Returns:
+            The items found, in no particular order.
+        """
+        items = []
+        request = {}
+        if projection:
+            request.update(projection_expression(projection))
+        limiter = self.limiter(table.name)
+        for start in range(0, len(keys), 100):
+            pending = keys[start:start + 100]
+            attempt = 0
+            while pending:
+                attempt += 1
+                response = self.request(self.resource, 'batch_get_item', metrics_table=table.name,
+                                        RequestItems={table.name: {**request, 'Keys': pending}})
+                items.extend(response.get('Responses', {}).get(table.name, []))
+                pending = response.get('UnprocessedKeys', {}).get(table.name, {}).get('Keys', [])
+                if not pending:
+                    break
+                limiter.on_throttle()
+                if attempt >= self.max_attempts:
+                    raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException',
+                                                 'Message': f'{len(pending)} keys unprocessed'}}, 'BatchGetItem')
+                time.sleep(self.backoff(attempt))
+        return items
+
+    def scan_pages(self, table, **kwargs) -> Iterator[List[dict]]:
+        """
+        Scan `table` following LastEvaluatedKey, yielding one page of items at a time.
+        """
+        while True:
+            response = self.request(table, 'scan', **kwargs)
+            yield response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def parallel_scan(self, table, total_segments: int = 4, max_workers: int = None,
+                      projection: Iterable[str] = None, **kwargs) -> Iterator[List[dict]]:
+        """
+        Scan the whole table with `total_segments` parallel segment scans, streaming pages as they arrive.
+
+        Args:
+            table: boto3 DynamoDB Table resource.
+            total_segments: number of Segment/TotalSegments slices scanned concurrently.
+            max_workers: worker threads (defaults to total_segments).
+            projection: attribute names to return; only these are read over the wire.
+            kwargs: extra scan arguments, e.g. FilterExpression.
+
+        Yields:
+            Lists of items, one per DynamoDB page, in no particular order.
+        """
+        if projection:
+            projected = projection_expression(projection)
+            kwargs['ProjectionExpression'] = projected['ProjectionExpression']
+            kwargs['ExpressionAttributeNames'] = {**kwargs.get('ExpressionAttributeNames', {}),
+                                                  **projected['ExpressionAttributeNames']}
+        pages = queue.Queue(maxsize=total_segments * 2)  # bounded so slow consumers apply back-pressure
+        stop = threading.Event()
+        segment_done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def scan_segment(segment: int) -> None:
+            try:
+                for page in self.scan_pages(table, Segment=segment, TotalSegments=total_segments, **kwargs):
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(segment_done)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers or total_segments,
+                                      thread_name_prefix=f'scan-{table.name}')
+        try:
+            for segment in range(total_segments):
+                executor.submit(scan_segment, segment)
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is segment_done:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def create_table(self, table_name: str, key_schema: list, attribute_definitions: list,
+                     billing_mode: str = None, read_capacity: int = None, write_capacity: int = None):
+        """
+        Create a table with on-demand or provisioned capacity.
+
+        Capacity defaults come from COINTRACKER_DDB_BILLING_MODE (PROVISIONED or PAY_PER_REQUEST),
+        COINTRACKER_DDB_READ_CAPACITY and COINTRACKER_DDB_WRITE_CAPACITY.
+        """
+        billing_mode = billing_mode or os.environ.get('COINTRACKER_DDB_BILLING_MODE', BILLING_MODE_PROVISIONED)
+        kwargs = {
+            'TableName': table_name,
+            'KeySchema': key_schema,
+            'AttributeDefinitions': attribute_definitions,
+            'BillingMode': billing_mode,
+        }
+        if billing_mode == BILLING_MODE_PROVISIONED:
+            kwargs['ProvisionedThroughput'] = {
+                'ReadCapacityUnits': read_capacity or int(os.environ.get('COINTRACKER_DDB_READ_CAPACITY', 10)),
+                'WriteCapacityUnits': write_capacity or int(os.environ.get('COINTRACKER_DDB_WRITE_CAPACITY', 10)),
+            }
+        return self.resource.create_table(**kwargs)
+
+
+_default_client: Optional[DynamoDBClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> DynamoDBClient:
+    """
+    Process-wide DynamoDBClient, so every table shares one connection pool and rate limiters.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = DynamoDBClient()
+        return _default_client
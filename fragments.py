@@ -0,0 +1,47 @@
+# fragments.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from markupsafe import Markup
+
+import metrics
+
+
+class FragmentCache:
+    """
+    LRU cache of rendered HTML fragments.
+
+    Keys must include everything the fragment depends on (e.g. the address's sync version
+    and the page cursor), so entries never need to expire: a new sync produces a new key
+    and the stale fragment simply ages out of the LRU.
+    """
+    def __init__(self, name: str = 'fragments', max_entries: int = None):
+        self.name = name
+        self.max_entries = max_entries or int(os.environ.get('COINTRACKER_FRAGMENT_CACHE_SIZE', 1000))
+        self._entries: 'OrderedDict[Hashable, Markup]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> Markup:
+        """
+        Cached fragment for key, rendering (and caching) it on a miss.
+        """
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+        metrics.record_cache(self.name, fragment is not None)
+        if fragment is not None:
+            return fragment
+
+        fragment = Markup(render())
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def __len__(self) -> int:
+        return len(self._entries)
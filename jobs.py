@@ -0,0 +1,178 @@
+# jobs.py
+"""
+Admin/maintenance jobs that walk whole tables.
+
+    python jobs.py refresh-addresses --segments 8 --workers 16
+    python jobs.py backfill-subscriptions
+"""
+import argparse
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List
+
+from coalescing import WriteCoalescer
+from main import SynchronizeBitcoinAddress
+from storage import BACKEND_DYNAMODB, get_backend
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshAllAddresses:
+    """
+    Refresh the balance and re-sync the transactions of every tracked BTC address.
+
+    Addresses are streamed from a parallel segmented scan of the BTC Balances table
+    (projecting only the keys needed) and synced in chunks on a worker pool, so neither the
+    scan nor the BlockChain.com calls are single-threaded. Each chunk goes through
+    `SynchronizeBitcoinAddress.sync_addresses`: one /balance call per chunk, and /rawaddr
+    downloads and transaction writes only for the addresses that changed. Balances of addresses
+    that were not re-synced come from the /balance summary and are coalesced: balances equal
+    to the scanned value are not rewritten and the rest are flushed in batches.
+    """
+    def __init__(self, total_segments: int = 4, max_workers: int = 8, chunk_size: int = None):
+        self.total_segments = total_segments
+        self.max_workers = max_workers
+        self.sync = SynchronizeBitcoinAddress()
+        self.chunk_size = chunk_size or self.sync.blockchain_api.SUMMARY_BATCH_SIZE
+        self.btc_balances_db = get_backend().btc_balances()
+        self.balance_writes = WriteCoalescer('btc_balances', self.write_balances, key_fields=('btc_address',))
+
+    def tracked_addresses(self) -> Iterator[str]:
+        """
+        Yield every btc_address in the BTC Balances table (each unique address once).
+        The scanned balances are remembered so unchanged balances are not rewritten.
+        """
+        for page in self.btc_balances_db.iter_pages(projection=['btc_address', 'btc_balance'],
+                                                    total_segments=self.total_segments):
+            self.balance_writes.mark_persisted(page)
+            for item in page:
+                yield item['btc_address']
+
+    def address_chunks(self) -> Iterator[List[str]]:
+        """
+        Group the tracked addresses into chunks of `chunk_size` (one /balance call each).
+        """
+        chunk = []
+        for btc_address in self.tracked_addresses():
+            chunk.append(btc_address)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def write_balances(self, items: List[dict]) -> bool:
+        """
+        Store coalesced balance updates (DynamoDB has no batched update, so one UpdateItem per address).
+        """
+        return all([self.btc_balances_db.update_balance(item['btc_address'], item['btc_balance']) for item in items])
+
+    def refresh_addresses(self, btc_addresses: List[str]) -> Dict[str, str]:
+        """
+        Refresh one chunk of addresses: re-sync the changed ones and store current balances.
+
+        Returns:
+            {btc_address: 'synced', 'skipped' or 'failed'}.
+        """
+        summaries, results = self.sync.sync_addresses(btc_addresses)
+        for btc_address, summary in summaries.items():
+            if results.get(btc_address) != 'synced':  # synced addresses stored their balance already
+                self.balance_writes.put({'btc_address': btc_address, 'btc_balance': summary['final_balance']})
+        return results
+
+    def run(self) -> dict:
+        """
+        Refresh every tracked address.
+
+        Returns:
+            Counts of 'refreshed' and 'failed' addresses.
+        """
+        summary = {'refreshed': 0, 'failed': 0}
+
+        def collect(futures):
+            for future in futures:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error("Address refresh failed: %s", e)
+                    summary['failed'] += futures[future]
+                    continue
+                for result in results.values():
+                    summary['failed' if result == 'failed' else 'refreshed'] += 1
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='refresh') as executor:
+            pending = {}  # future -> number of addresses in its chunk
+            for chunk in self.address_chunks():
+                pending[executor.submit(self.refresh_addresses, chunk)] = len(chunk)
+                if len(pending) >= self.max_workers * 2:  # bound in-flight work while the scan streams
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect({future: pending.pop(future) for future in done})
+            collect(pending)
+        if not self.balance_writes.flush():
+            logger.error("Some balance updates failed.")
+        logger.info("Refreshed %s addresses (%s failed).", summary['refreshed'], summary['failed'])
+        return summary
+
+
+class BackfillSubscriptions:
+    """
+    One-off migration of subscriptions stored by versions before `user_addresses`.
+
+    Those versions recorded the owner of an address in the `username` attribute of its
+    BTC Balances row. Every such row is linked to its owner in `user_addresses`, counted in
+    `subscribers` and stripped of `username`. Rows migrated already are skipped, so the job
+    can be re-run after a partial failure. Only DynamoDB tables predate `user_addresses`.
+    """
+    def __init__(self, total_segments: int = 4):
+        self.total_segments = total_segments
+        self.backend = get_backend()
+        self.btc_balances_db = self.backend.btc_balances()
+
+    def run(self) -> dict:
+        """
+        Migrate every legacy row.
+
+        Returns:
+            Counts of 'migrated', 'skipped' (already migrated) and 'failed' rows.
+        """
+        summary = {'migrated': 0, 'skipped': 0, 'failed': 0}
+        if self.backend.name != BACKEND_DYNAMODB:
+            logger.info("The '%s' backend has no legacy subscriptions to backfill.", self.backend.name)
+            return summary
+        for page in self.btc_balances_db.iter_pages(projection=['btc_address', 'username'],
+                                                    total_segments=self.total_segments):
+            for item in page:
+                if 'username' not in item:
+                    continue
+                try:
+                    migrated = self.btc_balances_db.link_legacy_owner(item['btc_address'], item['username'])
+                    summary['migrated' if migrated else 'skipped'] += 1
+                except Exception as e:
+                    logger.error("Failed to backfill btc_address '%s': %s", item['btc_address'], e)
+                    summary['failed'] += 1
+        logger.info("Backfilled %s subscriptions (%s already migrated, %s failed).",
+                    summary['migrated'], summary['skipped'], summary['failed'])
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CoinTracker maintenance jobs.')
+    subparsers = parser.add_subparsers(dest='job', required=True)
+    refresh = subparsers.add_parser('refresh-addresses', help='refresh balances and transactions of all addresses')
+    refresh.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    refresh.add_argument('--workers', type=int, default=8, help='address chunks refreshed concurrently')
+    refresh.add_argument('--chunk-size', type=int, default=None, help='addresses per /balance call')
+    backfill = subparsers.add_parser('backfill-subscriptions',
+                                     help='link addresses stored by older versions to their owners')
+    backfill.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.job == 'refresh-addresses':
+        RefreshAllAddresses(args.segments, args.workers, args.chunk_size).run()
+    elif args.job == 'backfill-subscriptions':
+        BackfillSubscriptions(args.segments).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,22 @@
 # main.py
 from database import *
 from blockchain_com_api import BlockChainAPI
-from typing import List, Any
+from storage import get_backend
+from coalescing import WriteCoalescer
+from typing import List, Any, Dict, Optional, Tuple
+import heapq
+import logging
+import os
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Confirmations after which a transaction is considered safe from reorgs.
+REORG_DEPTH = 6
+
+# Latest transactions stored per address sync; unset stores every transaction of the /rawaddr
+# response (BlockChainAPI.RAWADDR_LIMIT, the latest 50), enough for several /transactions pages.
+SYNC_TRANSACTIONS = int(os.environ['COINTRACKER_SYNC_TRANSACTIONS']) if os.environ.get('COINTRACKER_SYNC_TRANSACTIONS') else None
 
 class BitcoinAddresses:
     """ 
@@ -9,7 +24,7 @@ class BitcoinAddresses:
     Add and Remove Bitcoin Addresses given a BTC address
     """
     def __init__(self):
-        self.btc_balances_db = BTCBalancesDB()
+        self.btc_balances_db = get_backend().btc_balances()
         self.btc_addresses_for_user = []
     
     def add_address(self, btc_address: str, username: str):
@@ -21,14 +36,30 @@ class BitcoinAddresses:
         """
         return self.btc_balances_db.add_item(btc_address, username)
         
-    def remove_address(self, btc_address: str):
+    def remove_address(self, btc_address: str, username: str):
         """
-        Remove valid BTC address to BTCBalances DB
+        Remove BTC address from the username's tracked addresses
 
         Args:
             btc_address: valid BTC address
+            username: the user tracking btc_address
+        """
+        return self.btc_balances_db.remove_item(btc_address, username)
+
+    def is_synced(self, btc_address: str) -> bool:
+        """
+        Whether the (shared) transaction history of btc_address has already been synced
+        """
+        item = self.btc_balances_db.get_item(btc_address)
+        return bool(item and 'time_synced' in item)
+
+    def get_sync_versions(self, btc_addresses: List[str]) -> Dict[str, str]:
+        """
+        Sync version (time of the last transaction sync) of each address; it changes whenever
+        the stored transactions of the address change, so it can key rendered-page caches.
         """
-        return self.btc_balances_db.remove_item(btc_address)
+        items = self.btc_balances_db.get_items(list(btc_addresses))
+        return {btc_address: item.get('time_synced') for btc_address, item in items.items()}
 
     def get_btc_addresses_for_user(self, username: str):
         """
@@ -46,73 +77,236 @@ class SynchronizeBitcoinAddress:
         * Total balance for all addreses (NOT REQUIRED)
         * More?
     """
-    def __init__(self):
-        self.blockchain_api = BlockChainAPI()
-        self.transactions_db = TransactionsDB()
+    def __init__(self, blockchain_api: BlockChainAPI = None):
+        # pass the app's BlockChainAPI so its /balance and /latestblock caches are shared
+        self.blockchain_api = blockchain_api or BlockChainAPI()
+        self.transactions_db = get_backend().transactions()
+        self.btc_balances_db = get_backend().btc_balances()
+        # Transaction upserts are coalesced: repeated and unchanged rows are not rewritten
+        self.transaction_writes = WriteCoalescer('address_transactions', self.transactions_db.add_transactions,
+                                                 key_fields=('btc_address', 'tx_key'))
 
-    def add_transactions(self, username: str, btc_address: str) -> bool:
+    def add_transactions(self, btc_address: str, tip_height: int = None) -> bool:
         """
         Add transactions to the TransactionsDB table.
         We only care for this purpose on timestamp, balance, and fee
+        Transactions are stored once per address, however many users track it.
 
         Args:
-            username: the current logged in username
-            btc_address: a valid btc address that the username owns
+            btc_address: a valid btc address
+            tip_height: current chain tip height, stored with the sync state
         
         Returns:
             True if adding transaction is sucessful else false
         """
-        if self.blockchain_api.valid_btc_address(btc_address):
-            data = self.blockchain_api.get_data(btc_address)
-            if 'txs' in data:
-                txs_data_len = len(data['txs'])
-                num_of_transactions = 10 # We are only recording 10 transactions for testing purposes
-                # TODO: if you want to see more/less transactions please refer to this logic
-                print(f"Total length of transactions: {txs_data_len}")
-                
-                for i in range(min(num_of_transactions, txs_data_len)):
-                    if 'time' in data['txs'][i] and 'balance' in data['txs'][i] and 'fee' in data['txs'][i]:
-                        t_time = data['txs'][i]['time']
-                        t_balance = data['txs'][i]['balance']
-                        t_fee = data['txs'][i]['fee']
-                        self.transactions_db.add_transaction(username, i+1, btc_address, t_time, t_fee, t_balance)
-                    else:
-                        print(f"Insufficient data at {i}th instance.")
-                        break
+        fetched = self.fetch_transactions(btc_address)
+        if fetched is None:
+            return False
+        return self.commit_syncs([fetched], tip_height)[btc_address]
+
+    def fetch_transactions(self, btc_address: str) -> Optional[dict]:
+        """
+        Download the latest transactions of btc_address and queue the new or changed ones
+        for writing (see `commit_syncs`). The stored rows in the same time range are read
+        first, so unchanged transactions are not rewritten and stale ones can be removed.
+
+        Returns:
+            The fetched sync state, or None if the address data could not be fetched.
+        """
+        data = self.blockchain_api.get_data(btc_address)
+        if not data or 'txs' not in data:
+            logger.warning("Insufficient data for '%s'.", btc_address)
+            return None
+
+        txs_data_len = len(data['txs'])
+        logger.debug("Total length of transactions for '%s': %s", btc_address, txs_data_len)
+
+        items = []
+        for i, tx in enumerate(data['txs'][:SYNC_TRANSACTIONS]):
+            if 'time' in tx and 'balance' in tx and 'fee' in tx:
+                items.append(self.transactions_db.to_item(btc_address, tx.get('hash', str(i)),
+                                                          tx['time'], tx['fee'], tx['balance']))
             else:
-                print(f"Insufficient data.")
-                return False
-        return True
+                logger.warning("Insufficient data at %sth instance for '%s'.", i, btc_address)
+                break
 
-    def get_transactions_table_for_btc_address(self, btc_address: str) -> List[Any]:
+        stored = self.transactions_db.get_table(btc_address, len(items) * 2) if items else []
+        # rows deleted since they were written (address removed, reorg cleanup) must be rewritten
+        stored_keys = {item['tx_key'] for item in stored}
+        self.transaction_writes.forget(self.transaction_writes.key(item) for item in items
+                                       if item['tx_key'] not in stored_keys)
+        self.transaction_writes.mark_persisted(stored)
+        self.transaction_writes.put_many(items)
+        return {
+            'btc_address': btc_address,
+            'items': items,
+            'stored': stored,
+            'n_tx': data.get('n_tx', txs_data_len),
+            'final_balance': data.get('final_balance'),
+            'last_tx_height': data['txs'][0].get('block_height') if data['txs'] else None,
+        }
+
+    def commit_syncs(self, fetched: List[dict], tip_height: int = None) -> Dict[str, bool]:
+        """
+        Flush the queued transaction writes of every fetched address in shared batches, then
+        remove stale transactions and record the sync state of each address whose writes landed.
+
+        Returns:
+            {btc_address: True if synced}.
+        """
+        self.transaction_writes.flush()
+        results = {}
+        for sync_state in fetched:
+            btc_address = sync_state['btc_address']
+            if not self.transaction_writes.is_persisted(sync_state['items']):
+                logger.error("Transaction writes failed for '%s'.", btc_address)
+                results[btc_address] = False
+                continue
+            self.remove_stale_transactions(btc_address, sync_state['items'], sync_state['stored'])
+            self.btc_balances_db.mark_synced(btc_address, sync_state['n_tx'], sync_state['final_balance'],
+                                             sync_state['last_tx_height'], tip_height)
+            results[btc_address] = True
+        return results
+
+    def remove_stale_transactions(self, btc_address: str, items: List[dict], stored: List[dict] = None) -> None:
+        """
+        Delete stored transactions in the re-fetched time range that are no longer in the
+        address history, i.e. transactions dropped by a chain reorganisation.
+
+        Args:
+            btc_address: the synced btc address.
+            items: the freshly fetched transaction items.
+            stored: the stored transactions of that range, read before writing (queried if None).
+        """
+        if not items:
+            return
+        if stored is None:
+            stored = self.transactions_db.get_table(btc_address, len(items) * 2)
+        fetched_keys = {item['tx_key'] for item in items}
+        oldest_key = min(fetched_keys)
+        stale = [{'btc_address': btc_address, 'tx_key': item['tx_key']}
+                 for item in stored
+                 if item['tx_key'] >= oldest_key and item['tx_key'] not in fetched_keys]
+        if stale:
+            logger.info("Removing %s stale transactions for '%s'.", len(stale), btc_address)
+            self.transactions_db.remove_transaction_keys(stale)
+            self.transaction_writes.forget(self.transaction_writes.key(key) for key in stale)
+
+    @staticmethod
+    def is_unchanged(stored: dict, summary: dict, tip_height: int) -> bool:
+        """
+        Whether a synced address can be skipped: its transaction count and balance match the
+        last sync and either no block was mined since then or its latest transaction is buried
+        at least REORG_DEPTH blocks deep (shallower transactions are re-fetched once per new
+        block in case a reorg replaced them).
+        """
+        if not stored or 'time_synced' not in stored:
+            return False
+        if int(stored.get('n_tx', -1)) != summary.get('n_tx') or \
+                int(stored.get('btc_balance', -1)) != summary.get('final_balance'):
+            return False
+        if summary.get('n_tx') == 0:
+            return True
+        if tip_height is None:
+            return False
+        synced_height = stored.get('synced_height')
+        if synced_height is not None and int(synced_height) >= tip_height:
+            return True  # same chain tip as the last sync: nothing can have been reorganised since
+        last_tx_height = stored.get('last_tx_height')
+        if last_tx_height is None:
+            return False
+        return tip_height - int(last_tx_height) + 1 >= REORG_DEPTH
+
+    def sync_addresses(self, btc_addresses: List[str]) -> Tuple[dict, Dict[str, str]]:
+        """
+        Sync the transactions of every address that changed since its last sync.
+
+        One /balance summary call and one /latestblock call cover all addresses; the full
+        /rawaddr download and DynamoDB writes only happen for changed addresses.
+
+        Args:
+            btc_addresses: btc addresses to sync.
+
+        Returns:
+            The /balance summaries, {btc_address: {'final_balance', 'n_tx', ...}}, and the
+            result of each address, {btc_address: 'synced', 'skipped' or 'failed'}.
+        """
+        btc_addresses = list(btc_addresses)
+        if not btc_addresses:
+            return {}, {}
+        summaries = self.blockchain_api.get_summary(btc_addresses)
+        results = {}
+        tip_height = (self.blockchain_api.get_latest_block() or {}).get('height') if summaries else None
+        stored = self.btc_balances_db.get_items(btc_addresses) if summaries else {}
+
+        fetched = []
+        for btc_address in btc_addresses:
+            summary = summaries.get(btc_address)
+            if summary is None:
+                results[btc_address] = 'failed'
+            elif self.is_unchanged(stored.get(btc_address), summary, tip_height):
+                results[btc_address] = 'skipped'
+            else:
+                sync_state = self.fetch_transactions(btc_address)
+                if sync_state is None:
+                    results[btc_address] = 'failed'
+                else:
+                    fetched.append(sync_state)
+
+        # one flush writes the changed transactions of every address in shared batches
+        for btc_address, synced in self.commit_syncs(fetched, tip_height).items():
+            results[btc_address] = 'synced' if synced else 'failed'
+        for result in results.values():
+            metrics.SYNC_ADDRESSES.inc(result=result)
+        return summaries, results
+
+    def get_transactions_table_for_btc_address(self, btc_address: str, num_of_items: int = 20) -> List[Any]:
         """
         Get a list of transactions corresponding to the btc_address.
 
         Args:
             btc_address: a valid btc address string.
+            num_of_items: maximum number of transactions, latest first.
         
         Returns:
             A  list of transactions for the valid btc_address.
         """
-        transactions_table = self.transactions_db.get_table(btc_address)
-        transactions_list = []
+        transactions_table = self.transactions_db.get_table(btc_address, num_of_items)
+        return [self.format_transaction(transaction) for transaction in transactions_table]
+
+    def get_transactions_page(self, btc_address: str, page_size: int = 20, cursor: str = None) -> Tuple[List[Any], Optional[str]]:
+        """
+        Get one page of transactions for the btc_address, latest first.
+
+        Args:
+            btc_address: a valid btc address string.
+            page_size: maximum number of transactions on the page.
+            cursor: cursor returned with the previous page (None for the first page).
+
+        Returns:
+            (list of transactions, cursor of the next page or None on the last page).
+        """
+        transactions_table, next_cursor = self.transactions_db.get_page(btc_address, page_size, cursor)
+        return [self.format_transaction(transaction) for transaction in transactions_table], next_cursor
+
+    @staticmethod
+    def format_transaction(transaction: dict) -> dict:
+        """
+        Convert a stored transaction to display units (BTC).
+        """
         satoshi = float(100000000)
-        for transaction in transactions_table:
-            time = transaction['time']
-            balance = transaction['balance']
-            balance = round(int(balance)/satoshi, 10)
-            fee = transaction['fee']
-            fee = round(int(fee)/satoshi,10)
-            transactions_list.append({'timestamp':time, 'balance': balance, 'fee': fee})
-        return transactions_list
+        balance = round(int(transaction['balance'])/satoshi, 10)
+        fee = round(int(transaction['fee'])/satoshi, 10)
+        return {'timestamp': transaction['time'], 'balance': balance, 'fee': fee}
 
 class RetrieveData():
     """
     Retrieve the current balances and transactions for each btc address
     """
-    def __init__(self):
-        self.blockchain_api = BlockChainAPI()
-        self.sync = SynchronizeBitcoinAddress()
+    def __init__(self, sync: SynchronizeBitcoinAddress = None):
+        # sharing the sync instance shares its BlockChainAPI caches and write coalescer
+        self.sync = sync or SynchronizeBitcoinAddress()
+        self.blockchain_api = self.sync.blockchain_api
     
     def get_current_balance(self, btc_address: str) -> float:
         """
@@ -124,17 +318,33 @@ class RetrieveData():
         Returns:
             An amount in float format corresponding to the balance in BTC for the given address.
         """
+        return self.get_current_balances([btc_address])[btc_address]
+
+    def get_current_balances(self, btc_addresses: List[str]) -> Dict[str, float]:
+        """
+        Get current balances for many addresses with one batched summary call.
+
+        Returns:
+            {btc_address: balance in BTC}.
+        """
         satoshi = 100000000
-        current_balance = self.blockchain_api.get_balance(btc_address)
-        return round(int(current_balance)/satoshi,10)
+        summaries = self.blockchain_api.get_summary(btc_addresses)
+        balances = {}
+        for btc_address in btc_addresses:
+            if btc_address in summaries:
+                current_balance = summaries[btc_address]['final_balance']
+            else:
+                current_balance = self.blockchain_api.get_balance(btc_address)
+            balances[btc_address] = round(int(current_balance or 0)/satoshi,10)
+        return balances
     
     def get_total_amount(self, btc_addresses: List[str]) -> float:
         """
         Get total amount of BTC owned between all wallets.
         """
         total_btc_owned = 0.0
-        for btc_addr in btc_addresses:
-            total_btc_owned += self.get_current_balance(btc_addr)
+        for balance in self.get_current_balances(list(btc_addresses)).values():
+            total_btc_owned += balance
         return total_btc_owned
     
     def number_of_btc_addreses_owned(self, btc_addresses):
@@ -148,15 +358,25 @@ class RetrieveData():
         Geta List of btc_address and corresponding balance for the btc address.
         """
         btc_addresses_data = []
+        balances = self.get_current_balances(list(btc_addresses))
         for btc_addr in btc_addresses:
-            current_balance = self.get_current_balance(btc_addr)
+            current_balance = balances[btc_addr]
             btc_addresses_data.append({'btc_address': btc_addr, 'current_balance': current_balance})
         return btc_addresses_data
     
-    def get_btc_transactions(self, btc_addresses: List[str]) -> List[Any]:
+    def get_btc_transactions(self, btc_addresses: List[str], num_of_items: int = None) -> List[Any]:
+        """
+        Get the latest transactions across btc_addresses, latest first.
+
+        Args:
+            btc_addresses: btc addresses to include.
+            num_of_items: keep only this many transactions overall (the latest 20 of each address if None).
+        """
         btc_transactions = []
         for btc_address in btc_addresses:
-            transactions_for_btc_address = self.sync.get_transactions_table_for_btc_address(btc_address)
+            # any one address may hold all of the latest num_of_items, so each supplies that many
+            transactions_for_btc_address = self.sync.get_transactions_table_for_btc_address(
+                btc_address, num_of_items or 20)
             for transaction in transactions_for_btc_address:
                 btc_transactions.append({
                     'btc_address': btc_address,
@@ -165,5 +385,7 @@ class RetrieveData():
                     'timestamp': transaction['timestamp']
                 })
         # Sort transactions by timestamp (latest first)
+        if num_of_items is not None:
+            return heapq.nlargest(num_of_items, btc_transactions, key=lambda x: x['timestamp'])
         btc_transactions = sorted(btc_transactions, key=lambda x: x['timestamp'], reverse=True)
         return btc_transactions
\ No newline at end of file
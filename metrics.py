@@ -0,0 +1,236 @@
+# metrics.py
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow upstream calls.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: LabelKey = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonically increasing value, one series per label set.
+    """
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative bucketed observations (latencies), one series per label set.
+    """
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[LabelKey, list] = {}  # key -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(labels))
+        return series[2] if series else 0
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    le = (('le', _format_value(bound)),)
+                    lines.append(f'{self.name}_bucket{_format_labels(key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds every metric exported by the app and renders them in Prometheus text format.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# BlockChain.com API
+BLOCKCHAIN_API_REQUESTS = REGISTRY.counter(
+    'cointracker_blockchain_api_requests_total', 'Requests made to the BlockChain.com API.')
+BLOCKCHAIN_API_LATENCY = REGISTRY.histogram(
+    'cointracker_blockchain_api_request_seconds', 'Latency of BlockChain.com API requests.')
+
+# DynamoDB
+DDB_OPERATIONS = REGISTRY.counter(
+    'cointracker_dynamodb_operations_total', 'DynamoDB operations by table, operation and status.')
+DDB_LATENCY = REGISTRY.histogram(
+    'cointracker_dynamodb_operation_seconds', 'Latency of DynamoDB operations.')
+DDB_CONSUMED_CAPACITY = REGISTRY.counter(
+    'cointracker_dynamodb_consumed_capacity_units_total', 'Capacity units consumed by DynamoDB operations.')
+DDB_ITEMS = REGISTRY.counter(
+    'cointracker_dynamodb_items_total', 'Items returned (Count) and examined (ScannedCount) by DynamoDB reads.')
+
+# SQLite (embedded storage backend); reads are sub-millisecond, so buckets start at 50us.
+SQLITE_LATENCY = REGISTRY.histogram(
+    'cointracker_sqlite_operation_seconds', 'Latency of SQLite operations.',
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+
+# Write coalescing
+COALESCED_WRITES = REGISTRY.counter(
+    'cointracker_coalesced_writes_total',
+    'Upserts seen by the write coalescer by table and result (written/collapsed/skipped/failed).')
+
+# Address sync
+SYNC_ADDRESSES = REGISTRY.counter(
+    'cointracker_sync_addresses_total', 'Addresses checked by the sync layer by result (synced/skipped/failed).')
+
+# Password hashing
+KDF_LATENCY = REGISTRY.histogram(
+    'cointracker_password_kdf_seconds', 'Latency of password hashing/verification, including pool wait.')
+
+# Fiat valuation
+VALUATION_LATENCY = REGISTRY.histogram(
+    'cointracker_valuation_seconds', 'Latency of uncached portfolio valuations (load + as-of join).')
+
+# Caches
+CACHE_REQUESTS = REGISTRY.counter(
+    'cointracker_cache_requests_total', 'Cache lookups by cache name and result (hit/miss).')
+
+# Flask routes
+HTTP_REQUEST_LATENCY = REGISTRY.histogram(
+    'cointracker_http_request_seconds', 'Latency of Flask requests by route, method and status.')
+
+# Called with (histogram name, labels, elapsed seconds) after every timed block.
+_timer_listeners: List[Callable[[str, dict, float], None]] = []
+
+
+def add_timer_listener(listener: Callable[[str, dict, float], None]) -> None:
+    """
+    Register a callback invoked after every `timer` block completes.
+    """
+    _timer_listeners.append(listener)
+
+
+@contextmanager
+def timer(histogram: Histogram, **labels):
+    """
+    Observe the wall-clock duration of the wrapped block in `histogram`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **labels)
+        for listener in _timer_listeners:
+            listener(histogram.name, labels, elapsed)
+
+
+def record_ddb_response(table: str, operation: str, response: dict) -> None:
+    """
+    Record consumed capacity and item counts reported in a DynamoDB response.
+    """
+    consumed = response.get('ConsumedCapacity')
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    for capacity in consumed or []:
+        units = capacity.get('CapacityUnits')
+        if units is not None:
+            DDB_CONSUMED_CAPACITY.inc(float(units), table=table, operation=operation)
+    if 'Count' in response:
+        DDB_ITEMS.inc(response['Count'], table=table, operation=operation, kind='returned')
+    if 'ScannedCount' in response:
+        DDB_ITEMS.inc(response['ScannedCount'], table=table, operation=operation, kind='scanned')
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """
+    Count a cache lookup; hit rate is hits / (hits + misses) per cache.
+    """
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def render_latest() -> str:
+    """
+    Render all registered metrics in the Prometheus text exposition format.
+    """
+    return REGISTRY.render()
@@ -0,0 +1,183 @@
+# profiling.py
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from flask import Flask, request
+from flask.signals import before_render_template, template_rendered
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-CoinTracker-Profile'
+PROFILE_ID_HEADER = 'X-CoinTracker-Profile-Id'
+
+# Span category for each timed histogram (see metrics.timer).
+SPAN_CATEGORIES = {
+    metrics.BLOCKCHAIN_API_LATENCY.name: 'blockchain_api',
+    metrics.DDB_LATENCY.name: 'dynamodb',
+    metrics.SQLITE_LATENCY.name: 'sqlite',
+}
+
+
+class RequestProfile:
+    """
+    cProfile stats and a span breakdown captured for a single request.
+    """
+    def __init__(self, reason: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+        self.profiler: Optional[cProfile.Profile] = cProfile.Profile()
+        self._template_starts: List[float] = []
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is active (e.g. a concurrent request on Python >= 3.12); keep spans only.
+            self.profiler = None
+
+    def add_span(self, category: str, name: str, elapsed: float) -> None:
+        self.spans.append({
+            'category': category,
+            'name': name,
+            'start_ms': round((time.perf_counter() - elapsed - self.started) * 1000, 3),
+            'duration_ms': round(elapsed * 1000, 3),
+        })
+
+    def stop(self) -> float:
+        if self.profiler:
+            self.profiler.disable()
+        return time.perf_counter() - self.started
+
+    def breakdown(self, total: float) -> dict:
+        """
+        Total time per span category; whatever is left is attributed to 'other' (Flask, Python code).
+        """
+        totals = {}
+        for span in self.spans:
+            totals[span['category']] = totals.get(span['category'], 0.0) + span['duration_ms']
+        totals['other'] = max(0.0, total * 1000 - sum(totals.values()))
+        return {category: round(ms, 3) for category, ms in totals.items()}
+
+
+class RequestProfiler:
+    """
+    Opt-in per-request profiling for Flask routes.
+
+    A request is profiled when it carries `X-CoinTracker-Profile: <admin token>` or is picked
+    by sampling. Each profile is written to `profile_dir` as a `.prof` file (load it with
+    `pstats` or snakeviz) and a `.json` span breakdown of BlockChain.com, DynamoDB and
+    template rendering time.
+    """
+    def __init__(self, app: Flask = None, profile_dir: str = None, token: str = None, sample_rate: float = None):
+        self.profile_dir = profile_dir or os.environ.get('COINTRACKER_PROFILE_DIR', 'profiles')
+        self.token = token if token is not None else os.environ.get('COINTRACKER_PROFILE_TOKEN')
+        if sample_rate is None:
+            sample_rate = float(os.environ.get('COINTRACKER_PROFILE_SAMPLE_RATE', 0))
+        self.sample_rate = sample_rate
+        self._local = threading.local()
+        metrics.add_timer_listener(self._on_timer)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        before_render_template.connect(self._on_before_render, app, weak=False)
+        template_rendered.connect(self._on_rendered, app, weak=False)
+
+    @property
+    def active(self) -> Optional[RequestProfile]:
+        return getattr(self._local, 'profile', None)
+
+    def should_profile(self) -> Optional[str]:
+        """
+        Reason to profile the current request ('header' or 'sampled'), or None.
+        """
+        if self.token and request.headers.get(PROFILE_HEADER) == self.token:
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def _start(self):
+        reason = self.should_profile()
+        if reason:
+            self._local.profile = RequestProfile(reason)
+
+    def _finish(self, response):
+        profile = self.active
+        if profile is None:
+            return response
+        self._local.profile = None
+        total = profile.stop()
+        try:
+            self.write(profile, total, response.status_code)
+            response.headers[PROFILE_ID_HEADER] = profile.id
+        except Exception as e:
+            logger.error("Failed to write profile %s: %s", profile.id, e)
+        return response
+
+    def _teardown(self, exc):
+        # Request failed before after_request ran; drop the profile so it does not leak into the next request.
+        profile = self.active
+        if profile is not None:
+            profile.stop()
+            self._local.profile = None
+
+    def _on_timer(self, histogram_name: str, labels: dict, elapsed: float) -> None:
+        profile = self.active
+        if profile is not None:
+            category = SPAN_CATEGORIES.get(histogram_name, histogram_name)
+            name = '.'.join(str(value) for value in labels.values())
+            profile.add_span(category, name, elapsed)
+
+    def _on_before_render(self, sender, template, context, **extra):
+        profile = self.active
+        if profile is not None:
+            profile._template_starts.append(time.perf_counter())
+
+    def _on_rendered(self, sender, template, context, **extra):
+        profile = self.active
+        if profile is not None and profile._template_starts:
+            elapsed = time.perf_counter() - profile._template_starts.pop()
+            profile.add_span('template', template.name or 'template', elapsed)
+
+    def write(self, profile: RequestProfile, total: float, status_code: int) -> str:
+        """
+        Write `profile` to the profile directory; returns the path prefix of the written files.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        action = request.form.get('action') if request.method == 'POST' else None
+        slug = route.strip('/').replace('/', '_') or 'root'
+        prefix = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{slug}-{profile.id}")
+
+        if profile.profiler:
+            profile.profiler.dump_stats(prefix + '.prof')
+        summary = {
+            'id': profile.id,
+            'reason': profile.reason,
+            'route': route,
+            'method': request.method,
+            'action': action,
+            'status': status_code,
+            'total_ms': round(total * 1000, 3),
+            'breakdown_ms': profile.breakdown(total),
+            'spans': profile.spans,
+            'cprofile': prefix + '.prof' if profile.profiler else None,
+        }
+        with open(prefix + '.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        logger.info("Wrote %s profile for %s %s (%.1f ms) to '%s'.",
+                    profile.reason, request.method, route, total * 1000, prefix)
+        return prefix
@@ -0,0 +1,443 @@
+# sqlite_store.py
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import metrics
+from auth import get_hasher
+from blockchain_com_api import BlockChainAPI
+from storage import BTCBalancesStore, TransactionsStore, UserAddressesStore, UsersStore
+
+logger = logging.getLogger(__name__)
+
+# Same tables and keys as the DynamoDB backend. WITHOUT ROWID stores each table clustered
+# on its primary key, so lookups by username / (username, btc_address) / btc_address and
+# time-ordered ranges of an address's transactions (tx_key starts with the time) are a
+# single index walk. Every query filters on a primary key prefix, so there are no secondary
+# indexes to maintain on writes (the DROPs remove ones created by earlier versions).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT,
+    time_registered TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_addresses (
+    username TEXT NOT NULL,
+    btc_address TEXT NOT NULL,
+    time_added TEXT,
+    PRIMARY KEY (username, btc_address)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS user_addresses_by_address;
+
+CREATE TABLE IF NOT EXISTS btc_balances (
+    btc_address TEXT PRIMARY KEY,
+    time_added TEXT,
+    time_refreshed TEXT,
+    time_synced TEXT,
+    btc_balance INTEGER,
+    subscribers INTEGER NOT NULL DEFAULT 0,
+    n_tx INTEGER,
+    last_tx_height INTEGER,
+    synced_height INTEGER
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS address_transactions (
+    btc_address TEXT NOT NULL,
+    tx_key TEXT NOT NULL,
+    tx_hash TEXT,
+    time TEXT,
+    timestamp INTEGER,
+    balance INTEGER,
+    fee INTEGER,
+    PRIMARY KEY (btc_address, tx_key)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS address_transactions_by_time;
+"""
+
+BTC_BALANCES_COLUMNS = ('btc_address', 'time_added', 'time_refreshed', 'time_synced', 'btc_balance',
+                        'subscribers', 'n_tx', 'last_tx_height', 'synced_height')
+
+# SQLite limits the number of '?' parameters per statement (999 in older builds).
+MAX_VARIABLES = 500
+
+
+def _to_item(row: sqlite3.Row) -> dict:
+    # Like DynamoDB items, unset (NULL) attributes are left out.
+    return {key: row[key] for key in row.keys() if row[key] is not None}
+
+
+class SQLiteDatabase:
+    """
+    One SQLite file shared by every table, with one connection per thread.
+
+    The database runs in WAL mode, so reads never block on the single writer and
+    commits only fsync the log (synchronous=NORMAL). Writes take the write lock up
+    front (BEGIN IMMEDIATE) and wait up to `timeout` seconds for it.
+    """
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.create_tables()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)  # explicit transactions
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def create_tables(self) -> None:
+        self.connection().executescript(SCHEMA)
+        logger.debug("SQLite tables ready in '%s'.", self.path)
+
+    def query(self, table: str, operation: str, sql: str, params=()) -> List[sqlite3.Row]:
+        """
+        Run a read statement and return all rows.
+        """
+        with metrics.timer(metrics.SQLITE_LATENCY, table=table, operation=operation):
+            return self.connection().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self, table: str, operation: str):
+        """
+        Run the wrapped statements as one write transaction; yields the connection.
+        """
+        conn = self.connection()
+        with metrics.timer(metrics.SQLITE_LATENCY, table=table, operation=operation):
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# UsersDB
+class SQLiteUsersDB(UsersStore):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        self.table_name = 'users'
+
+    def add_user(self, username: str, password: str) -> bool:
+        """
+        Adds a new username if it does not exist. Only a salted scrypt hash of the password is stored.
+        """
+        created_time_utc = datetime.now(timezone.utc).isoformat()
+        try:
+            password_hash = get_hasher().hash_password(password)
+            with self.db.transaction(self.table_name, 'insert') as conn:
+                conn.execute('INSERT INTO users (username, password_hash, time_registered) VALUES (?, ?, ?)',
+                             (username, password_hash, created_time_utc))
+            logger.info("User '%s' succesfully added to the database.", username)
+            return True
+        except Exception as e:
+            logger.error("Failed to add user '%s': %s", username, e)
+            return False
+
+    def get_user(self, username: str) -> Optional[dict]:
+        try:
+            rows = self.db.query(self.table_name, 'get', 'SELECT * FROM users WHERE username = ?', (username,))
+            return _to_item(rows[0]) if rows else None
+        except Exception as e:
+            logger.error("Error attempting to retrieve username '%s': %s", username, e)
+            return None
+
+    def set_password_hash(self, username: str, password_hash: str) -> bool:
+        try:
+            with self.db.transaction(self.table_name, 'update') as conn:
+                cursor = conn.execute('UPDATE users SET password_hash = ? WHERE username = ?', (password_hash, username))
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error("Failed to update password of username '%s': %s", username, e)
+            return False
+
+
+# UserAddressesDB
+class SQLiteUserAddressesDB(UserAddressesStore):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        self.table_name = 'user_addresses'
+
+    def add_address(self, username: str, btc_address: str) -> bool:
+        with self.db.transaction(self.table_name, 'insert') as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO user_addresses (username, btc_address, time_added) VALUES (?, ?, ?)',
+                (username, btc_address, datetime.now(timezone.utc).isoformat()))
+        return cursor.rowcount > 0
+
+    def remove_address(self, username: str, btc_address: str) -> bool:
+        with self.db.transaction(self.table_name, 'delete') as conn:
+            cursor = conn.execute('DELETE FROM user_addresses WHERE username = ? AND btc_address = ?',
+                                  (username, btc_address))
+        return cursor.rowcount > 0
+
+    def get_btc_addresses_for_user(self, username: str) -> set:
+        rows = self.db.query(self.table_name, 'query',
+                             'SELECT btc_address FROM user_addresses WHERE username = ?', (username,))
+        return {row['btc_address'] for row in rows}
+
+
+# BTCBalancesDB
+class SQLiteBTCBalancesDB(BTCBalancesStore):
+    """
+    Shared per-address data. Linking/unlinking a user and the subscriber count change
+    in the same transaction, so the count cannot drift from user_addresses.
+    """
+    PAGE_SIZE = 1000
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        self.table_name = 'btc_balances'
+        self.blockchain_api = BlockChainAPI()
+        self.user_addresses_db = SQLiteUserAddressesDB(db)
+
+    def get_table(self) -> List[dict]:
+        try:
+            items = []
+            for page in self.iter_pages():
+                items.extend(page)
+            return items
+        except Exception as e:
+            logger.error("Failed to obtain table %s: %s", self.table_name, e)
+            return []
+
+    def iter_pages(self, projection: List[str] = None, total_segments: int = 4) -> Iterator[List[dict]]:
+        """
+        Stream the whole table in primary-key order, PAGE_SIZE rows at a time.
+        A local file has no segments to scan in parallel, so total_segments is ignored.
+        """
+        columns = list(projection or BTC_BALANCES_COLUMNS)
+        unknown = set(columns) - set(BTC_BALANCES_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown {self.table_name} attributes: {sorted(unknown)}")
+        if 'btc_address' not in columns:
+            columns.append('btc_address')  # needed to resume after the last row
+        select = f"SELECT {', '.join(columns)} FROM btc_balances"
+        last_address = None
+        while True:
+            if last_address is None:
+                rows = self.db.query(self.table_name, 'scan', f'{select} ORDER BY btc_address LIMIT ?',
+                                     (self.PAGE_SIZE,))
+            else:
+                rows = self.db.query(self.table_name, 'scan',
+                                     f'{select} WHERE btc_address > ? ORDER BY btc_address LIMIT ?',
+                                     (last_address, self.PAGE_SIZE))
+            if not rows:
+                return
+            yield [_to_item(row) for row in rows]
+            if len(rows) < self.PAGE_SIZE:
+                return
+            last_address = rows[-1]['btc_address']
+
+    def get_item(self, btc_address: str) -> Optional[dict]:
+        try:
+            rows = self.db.query(self.table_name, 'get', 'SELECT * FROM btc_balances WHERE btc_address = ?',
+                                 (btc_address,))
+            return _to_item(rows[0]) if rows else None
+        except Exception as e:
+            logger.error("Failed to get btc_address '%s': %s", btc_address, e)
+            return None
+
+    def get_items(self, btc_addresses: List[str]) -> dict:
+        try:
+            btc_addresses = list(dict.fromkeys(btc_addresses))
+            items = {}
+            for i in range(0, len(btc_addresses), MAX_VARIABLES):
+                chunk = btc_addresses[i:i + MAX_VARIABLES]
+                rows = self.db.query(self.table_name, 'batch_get',
+                                     f"SELECT * FROM btc_balances WHERE btc_address IN ({', '.join('?' * len(chunk))})",
+                                     chunk)
+                items.update((row['btc_address'], _to_item(row)) for row in rows)
+            return items
+        except Exception as e:
+            logger.error("Failed to get btc_addresses %s: %s", btc_addresses, e)
+            return {}
+
+    def add_item(self, btc_address: str, username: str) -> bool:
+        """
+        Adds btc_address (once, shared by every user) and links it to username.
+        The address is only validated and its balance fetched the first time anyone tracks it.
+        """
+        created_time_utc = datetime.now(timezone.utc).isoformat()
+        try:
+            btc_balance = None
+            if self.get_item(btc_address) is None:
+                if not self.blockchain_api.valid_btc_address(btc_address):  # check that it is a valid BTC address
+                    return False
+                btc_balance = self.blockchain_api.get_balance(btc_address) or 0
+
+            with self.db.transaction(self.table_name, 'add_item') as conn:
+                if btc_balance is not None:
+                    conn.execute('INSERT OR IGNORE INTO btc_balances (btc_address, time_added, btc_balance, subscribers) '
+                                 'VALUES (?, ?, ?, 0)', (btc_address, created_time_utc, btc_balance))
+                linked = conn.execute(
+                    'INSERT OR IGNORE INTO user_addresses (username, btc_address, time_added) VALUES (?, ?, ?)',
+                    (username, btc_address, created_time_utc)).rowcount
+                if linked:
+                    conn.execute('UPDATE btc_balances SET subscribers = subscribers + 1 WHERE btc_address = ?',
+                                 (btc_address,))
+            logger.info("btc_address '%s' linked to username '%s'.", btc_address, username)
+            return True
+        except Exception as e:
+            logger.error("Failed to add btc_address '%s': %s", btc_address, e)
+            return False
+
+    def remove_item(self, btc_address: str, username: str) -> bool:
+        """
+        Unlinks btc_address from username. The shared address data and its transactions
+        are deleted once no user tracks the address anymore.
+        """
+        try:
+            with self.db.transaction(self.table_name, 'remove_item') as conn:
+                unlinked = conn.execute('DELETE FROM user_addresses WHERE username = ? AND btc_address = ?',
+                                        (username, btc_address)).rowcount
+                if unlinked:
+                    conn.execute('UPDATE btc_balances SET subscribers = subscribers - 1 WHERE btc_address = ?',
+                                 (btc_address,))
+                    row = conn.execute('SELECT subscribers FROM btc_balances WHERE btc_address = ?',
+                                       (btc_address,)).fetchone()
+                    if row is None or row['subscribers'] <= 0:
+                        conn.execute('DELETE FROM btc_balances WHERE btc_address = ?', (btc_address,))
+                        conn.execute('DELETE FROM address_transactions WHERE btc_address = ?', (btc_address,))
+            if not unlinked:
+                logger.warning("Username '%s' does not track btc_address '%s'.", username, btc_address)
+                return False
+            logger.info("btc_address '%s' unlinked from username '%s'.", btc_address, username)
+            return True
+        except Exception as e:
+            logger.error("Failed to remove item with btc_address '%s' : %s", btc_address, e)
+            return False
+
+    def update_balance(self, btc_address: str, btc_balance: int) -> bool:
+        refreshed_time_utc = datetime.now(timezone.utc).isoformat()
+        try:
+            with self.db.transaction(self.table_name, 'update') as conn:
+                cursor = conn.execute('UPDATE btc_balances SET btc_balance = ?, time_refreshed = ? WHERE btc_address = ?',
+                                      (btc_balance, refreshed_time_utc, btc_address))
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error("Failed to update balance for btc_address '%s': %s", btc_address, e)
+            return False
+
+    def mark_synced(self, btc_address: str, n_tx: int, btc_balance: int = None,
+                    last_tx_height: int = None, synced_height: int = None) -> bool:
+        synced_time_utc = datetime.now(timezone.utc).isoformat()
+        try:
+            with self.db.transaction(self.table_name, 'update') as conn:
+                cursor = conn.execute(
+                    'UPDATE btc_balances SET time_synced = ?, n_tx = ?, last_tx_height = ?, synced_height = ?, '
+                    'btc_balance = COALESCE(?, btc_balance) WHERE btc_address = ?',
+                    (synced_time_utc, n_tx, last_tx_height, synced_height, btc_balance, btc_address))
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error("Failed to mark btc_address '%s' as synced: %s", btc_address, e)
+            return False
+
+    def get_btc_addresses_for_user(self, username: str) -> set:
+        try:
+            return self.user_addresses_db.get_btc_addresses_for_user(username)
+        except Exception as e:
+            logger.error("Failed to retrieve btc addresses for username '%s': %s", username, e)
+            return set()
+
+
+# TransactionsDB
+class SQLiteTransactionsDB(TransactionsStore):
+    """
+    Transaction history per BTC address. Bulk writes run as one executemany in one
+    transaction (one commit however many rows).
+    """
+    COLUMNS = ('btc_address', 'tx_key', 'tx_hash', 'time', 'timestamp', 'balance', 'fee')
+    INSERT = (f"INSERT OR REPLACE INTO address_transactions ({', '.join(COLUMNS)}) "
+              f"VALUES ({', '.join('?' * len(COLUMNS))})")
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        self.table_name = 'address_transactions'
+
+    def add_transaction(self, btc_address: str, tx_hash: str, timestamp: int, fee: int, balance: int) -> bool:
+        return self.add_transactions([self.to_item(btc_address, tx_hash, timestamp, fee, balance)])
+
+    def add_transactions(self, items: List[dict]) -> bool:
+        try:
+            with self.db.transaction(self.table_name, 'bulk_insert') as conn:
+                conn.executemany(self.INSERT, ([item[column] for column in self.COLUMNS] for item in items))
+            return True
+        except Exception as e:
+            logger.error("Failed to add %s transactions: %s", len(items), e)
+            return False
+
+    def remove_transaction_keys(self, keys: List[dict]) -> bool:
+        try:
+            with self.db.transaction(self.table_name, 'bulk_delete') as conn:
+                conn.executemany('DELETE FROM address_transactions WHERE btc_address = ? AND tx_key = ?',
+                                 ((key['btc_address'], key['tx_key']) for key in keys))
+            return True
+        except Exception as e:
+            logger.error("Failed to remove %s transactions: %s", len(keys), e)
+            return False
+
+    def remove_transactions(self, btc_address: str) -> bool:
+        try:
+            with self.db.transaction(self.table_name, 'delete') as conn:
+                conn.execute('DELETE FROM address_transactions WHERE btc_address = ?', (btc_address,))
+            return True
+        except Exception as e:
+            logger.error("Failed to remove transactions of btc_address %s: %s", btc_address, e)
+            return False
+
+    def get_page(self, btc_address: str, page_size: int = 20, cursor: str = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        One page of btc_address's transactions, latest first. One extra row is read to
+        tell whether another page follows.
+        """
+        try:
+            if cursor:
+                rows = self.db.query(self.table_name, 'query',
+                                     'SELECT * FROM address_transactions WHERE btc_address = ? AND tx_key < ? '
+                                     'ORDER BY tx_key DESC LIMIT ?', (btc_address, cursor, page_size + 1))
+            else:
+                rows = self.db.query(self.table_name, 'query',
+                                     'SELECT * FROM address_transactions WHERE btc_address = ? '
+                                     'ORDER BY tx_key DESC LIMIT ?', (btc_address, page_size + 1))
+            items = [_to_item(row) for row in rows[:page_size]]
+            next_cursor = items[-1]['tx_key'] if len(rows) > page_size else None
+            return items, next_cursor
+        except Exception as e:
+            logger.error("Failed to obtain page of table %s: %s", self.table_name, e)
+            return [], None
+
+    def get_table(self, btc_address: str, num_of_items: int = 20) -> List[dict]:
+        try:
+            rows = self.db.query(self.table_name, 'query',
+                                 'SELECT * FROM address_transactions WHERE btc_address = ? '
+                                 'ORDER BY tx_key DESC LIMIT ?', (btc_address, num_of_items))
+            return [_to_item(row) for row in rows]
+        except Exception as e:
+            logger.error("Failed to obtain table %s: %s", self.table_name, e)
+            return []
+
+    def get_history(self, btc_address: str) -> List[dict]:
+        try:
+            rows = self.db.query(self.table_name, 'query',
+                                 'SELECT timestamp, balance, fee FROM address_transactions WHERE btc_address = ? '
+                                 'ORDER BY tx_key', (btc_address,))
+            return [_to_item(row) for row in rows]
+        except Exception as e:
+            logger.error("Failed to obtain history of btc_address %s: %s", btc_address, e)
+            return []
@@ -0,0 +1,270 @@
+# storage.py
+"""
+Storage backend interface.
+
+Every table CoinTracker uses has an interface below, implemented for DynamoDB
+(database.py) and for an embedded SQLite file (sqlite_store.py). The backend is
+chosen with environment variables:
+
+    COINTRACKER_STORAGE_BACKEND=dynamodb   (default)
+    COINTRACKER_STORAGE_BACKEND=sqlite     COINTRACKER_SQLITE_PATH=cointracker.db
+"""
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DYNAMODB = 'dynamodb'
+BACKEND_SQLITE = 'sqlite'
+
+
+class UsersStore(ABC):
+    """
+    Registered users, keyed by username.
+    """
+    @abstractmethod
+    def add_user(self, username: str, password: str) -> bool:
+        """Store a new user with a salted hash of password."""
+
+    @abstractmethod
+    def get_user(self, username: str) -> Optional[dict]:
+        """The stored user record, or None."""
+
+    @abstractmethod
+    def set_password_hash(self, username: str, password_hash: str) -> bool:
+        """Replace the stored credentials of username with password_hash."""
+
+
+class UserAddressesStore(ABC):
+    """
+    Which user tracks which BTC address (one row per subscription).
+    """
+    @abstractmethod
+    def add_address(self, username: str, btc_address: str) -> bool:
+        """Link btc_address to username; False if already linked."""
+
+    @abstractmethod
+    def remove_address(self, username: str, btc_address: str) -> bool:
+        """Unlink btc_address from username; False if it was not linked."""
+
+    @abstractmethod
+    def get_btc_addresses_for_user(self, username: str) -> Set[str]:
+        """Every BTC address linked to username."""
+
+
+class BTCBalancesStore(ABC):
+    """
+    Shared per-address data (balance, sync state, number of subscribers), keyed by btc_address.
+    """
+    @abstractmethod
+    def get_table(self) -> List[dict]:
+        """Every tracked address."""
+
+    @abstractmethod
+    def iter_pages(self, projection: List[str] = None, total_segments: int = 4) -> Iterator[List[dict]]:
+        """Stream every tracked address in pages, fetching only `projection` attributes."""
+
+    @abstractmethod
+    def get_item(self, btc_address: str) -> Optional[dict]:
+        """Shared data for btc_address, or None if no user tracks it."""
+
+    @abstractmethod
+    def get_items(self, btc_addresses: List[str]) -> dict:
+        """{btc_address: item} for every tracked address in btc_addresses."""
+
+    @abstractmethod
+    def add_item(self, btc_address: str, username: str) -> bool:
+        """Track btc_address (validated and stored once) and link it to username."""
+
+    @abstractmethod
+    def remove_item(self, btc_address: str, username: str) -> bool:
+        """Unlink btc_address from username, deleting its data once nobody tracks it."""
+
+    @abstractmethod
+    def update_balance(self, btc_address: str, btc_balance: int) -> bool:
+        """Store a freshly fetched balance for an existing btc_address."""
+
+    @abstractmethod
+    def mark_synced(self, btc_address: str, n_tx: int, btc_balance: int = None,
+                    last_tx_height: int = None, synced_height: int = None) -> bool:
+        """Record the sync state of btc_address."""
+
+    @abstractmethod
+    def get_btc_addresses_for_user(self, username: str) -> Set[str]:
+        """Every BTC address linked to username."""
+
+
+class TransactionsStore(ABC):
+    """
+    Transaction history per BTC address, keyed by btc_address and tx_key = '<time>#<tx hash>'.
+    """
+    @staticmethod
+    def to_item(btc_address: str, tx_hash: str, timestamp: int, fee: int, balance: int) -> dict:
+        """
+        Build the stored item for one transaction.
+        """
+        utc_datetime_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        return {
+            'btc_address': btc_address,
+            'tx_key': f'{utc_datetime_str}#{tx_hash}',
+            'tx_hash': tx_hash,
+            'time': utc_datetime_str,
+            'timestamp': timestamp,
+            'balance': balance,
+            'fee': fee,
+        }
+
+    @abstractmethod
+    def add_transaction(self, btc_address: str, tx_hash: str, timestamp: int, fee: int, balance: int) -> bool:
+        """Store one transaction."""
+
+    @abstractmethod
+    def add_transactions(self, items: List[dict]) -> bool:
+        """Store many items built with `to_item` in bulk."""
+
+    @abstractmethod
+    def remove_transaction_keys(self, keys: List[dict]) -> bool:
+        """Delete the given {btc_address, tx_key} keys in bulk."""
+
+    @abstractmethod
+    def remove_transactions(self, btc_address: str) -> bool:
+        """Delete every stored transaction of btc_address."""
+
+    @abstractmethod
+    def get_page(self, btc_address: str, page_size: int = 20, cursor: str = None) -> Tuple[List[dict], Optional[str]]:
+        """One page of btc_address's transactions (latest first) and the cursor of the next page."""
+
+    @abstractmethod
+    def get_table(self, btc_address: str, num_of_items: int = 20) -> List[dict]:
+        """The latest num_of_items transactions of btc_address, latest first."""
+
+    @abstractmethod
+    def get_history(self, btc_address: str) -> List[dict]:
+        """Timestamp, balance and fee of every stored transaction of btc_address, oldest first."""
+
+
+class StorageBackend(ABC):
+    """
+    Creates the tables of one storage backend.
+    """
+    name: str
+
+    @abstractmethod
+    def create_tables(self) -> None:
+        """Create any missing tables."""
+
+    @abstractmethod
+    def users(self) -> UsersStore:
+        pass
+
+    @abstractmethod
+    def user_addresses(self) -> UserAddressesStore:
+        pass
+
+    @abstractmethod
+    def btc_balances(self) -> BTCBalancesStore:
+        pass
+
+    @abstractmethod
+    def transactions(self) -> TransactionsStore:
+        pass
+
+
+class DynamoDBBackend(StorageBackend):
+    """
+    Tables in DynamoDB (see database.py and ddb_client.py).
+    """
+    name = BACKEND_DYNAMODB
+
+    def create_tables(self) -> None:
+        import database
+        database.main()
+
+    def users(self) -> UsersStore:
+        from database import UsersDB
+        return UsersDB()
+
+    def user_addresses(self) -> UserAddressesStore:
+        from database import UserAddressesDB
+        return UserAddressesDB()
+
+    def btc_balances(self) -> BTCBalancesStore:
+        from database import BTCBalancesDB
+        return BTCBalancesDB()
+
+    def transactions(self) -> TransactionsStore:
+        from database import TransactionsDB
+        return TransactionsDB()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Tables in one local SQLite file (see sqlite_store.py), for single-node deployments,
+    edge caches and running the hot paths without AWS.
+    """
+    name = BACKEND_SQLITE
+
+    def __init__(self, path: str = None):
+        from sqlite_store import SQLiteDatabase
+        self.path = path or os.environ.get('COINTRACKER_SQLITE_PATH', 'cointracker.db')
+        self.db = SQLiteDatabase(self.path)
+
+    def create_tables(self) -> None:
+        self.db.create_tables()
+
+    def users(self) -> UsersStore:
+        from sqlite_store import SQLiteUsersDB
+        return SQLiteUsersDB(self.db)
+
+    def user_addresses(self) -> UserAddressesStore:
+        from sqlite_store import SQLiteUserAddressesDB
+        return SQLiteUserAddressesDB(self.db)
+
+    def btc_balances(self) -> BTCBalancesStore:
+        from sqlite_store import SQLiteBTCBalancesDB
+        return SQLiteBTCBalancesDB(self.db)
+
+    def transactions(self) -> TransactionsStore:
+        from sqlite_store import SQLiteTransactionsDB
+        return SQLiteTransactionsDB(self.db)
+
+
+_default_backend: Optional[StorageBackend] = None
+_default_backend_lock = threading.Lock()
+
+
+def create_backend(name: str = None) -> StorageBackend:
+    """
+    Backend called name ('dynamodb' or 'sqlite'), from COINTRACKER_STORAGE_BACKEND if None.
+    """
+    name = (name or os.environ.get('COINTRACKER_STORAGE_BACKEND', BACKEND_DYNAMODB)).lower()
+    if name == BACKEND_DYNAMODB:
+        return DynamoDBBackend()
+    if name == BACKEND_SQLITE:
+        return SQLiteBackend()
+    raise ValueError(f"Unknown storage backend '{name}' (expected '{BACKEND_DYNAMODB}' or '{BACKEND_SQLITE}').")
+
+
+def get_backend() -> StorageBackend:
+    """
+    Process-wide storage backend, chosen by COINTRACKER_STORAGE_BACKEND.
+    """
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = create_backend()
+            logger.info("Using '%s' storage backend.", _default_backend.name)
+        return _default_backend
+
+
+def set_backend(backend: Optional[StorageBackend]) -> None:
+    """
+    Replace the process-wide backend (None re-reads the environment on next use).
+    """
+    global _default_backend
+    with _default_backend_lock:
+        _default_backend = backend
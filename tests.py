@@ -1,8 +1,29 @@
 import unittest
+import unittest.mock
 from unittest.mock import patch
 from blockchain_com_api import BlockChainAPI
 from database import UsersDB, BTCBalancesDB, TransactionsDB
 from main import BitcoinAddresses, SynchronizeBitcoinAddress, RetrieveData
+import metrics
+import benchmarks
+import json
+import os
+import tempfile
+from flask import Flask, render_template_string
+from profiling import RequestProfiler, PROFILE_HEADER, PROFILE_ID_HEADER
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from ddb_client import AdaptiveRateLimiter, DynamoDBClient
+from auth import PasswordHasher, UserCache, UserSessions
+from fragments import FragmentCache
+from coalescing import WriteCoalescer
+from decimal import Decimal
+import time
+import uuid
+import storage
+from storage import SQLiteBackend, create_backend
+from jobs import RefreshAllAddresses
+import numpy as np
+from valuation import PortfolioHistory, PortfolioValuation, PriceSeries, PriceStore, to_json
 
 # ---------------- #
 # datbase.py TESTS #
@@ -10,16 +31,22 @@ from main import BitcoinAddresses, SynchronizeBitcoinAddress, RetrieveData
 class TestUsersDB(unittest.TestCase):
     def test_add_user(self):
         # Test adding a user
-        username = "daniel"
+        username = f"daniel_{uuid.uuid4().hex[:8]}"
         password = "cointracker_pw"
         users_db = UsersDB()
         result = users_db.add_user(username, password)
         self.assertTrue(result)
 
+        # Registering the same username again must not overwrite the account
+        self.assertFalse(users_db.add_user(username, "other_pw"))
+        password_hash = users_db.get_user(username)['password_hash']
+        self.assertTrue(PasswordHasher().verify_password(password, password_hash))
+
     def test_get_user(self):
         # Test getting a user
         username = "daniel"
         users_db = UsersDB()
+        users_db.add_user(username, "cointracker_pw")  # no-op if it exists already
         user_info = users_db.get_user(username)
         self.assertIsNotNone(user_info)
         self.assertEqual(user_info['username'], username)
@@ -57,9 +84,43 @@ class TestBTCBalancesDB(unittest.TestCase):
         btc_balances_db.add_item(btc_address, "satoshi")
 
         # Remove the item
-        result = btc_balances_db.remove_item(btc_address)
+        result = btc_balances_db.remove_item(btc_address, "satoshi")
         self.assertTrue(result)
 
+        # Removing it again fails: satoshi no longer tracks it
+        result = btc_balances_db.remove_item(btc_address, "satoshi")
+        self.assertFalse(result)
+
+    def test_link_legacy_owner(self):
+        # Rows written before user_addresses existed record their owner in 'username'
+        btc_balances_db = BTCBalancesDB()
+        btc_address = "1BoatSLRHtKNngkdXEeobR76b53LETtpyT"
+        btc_balances_db.table.put_item(Item={'btc_address': btc_address, 'username': "satoshi", 'btc_balance': 0})
+
+        self.assertTrue(btc_balances_db.link_legacy_owner(btc_address, "satoshi"))
+        self.assertFalse(btc_balances_db.link_legacy_owner(btc_address, "satoshi"))  # re-runs are no-ops
+        item = btc_balances_db.get_item(btc_address)
+        self.assertNotIn('username', item)
+        self.assertEqual(item['subscribers'], 1)
+        self.assertIn(btc_address, btc_balances_db.get_btc_addresses_for_user("satoshi"))
+        btc_balances_db.remove_item(btc_address, "satoshi")
+
+    def test_shared_address_data(self):
+        # Two users tracking the same address share one BTC Balances row
+        btc_balances_db = BTCBalancesDB()
+        btc_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"  # Satoshi's address
+
+        btc_balances_db.add_item(btc_address, "satoshi")
+        btc_balances_db.add_item(btc_address, "daniel")
+        self.assertIn(btc_address, btc_balances_db.get_btc_addresses_for_user("satoshi"))
+        self.assertIn(btc_address, btc_balances_db.get_btc_addresses_for_user("daniel"))
+
+        # One user removing it keeps it for the other
+        btc_balances_db.remove_item(btc_address, "daniel")
+        self.assertIn(btc_address, btc_balances_db.get_btc_addresses_for_user("satoshi"))
+        self.assertIsNotNone(btc_balances_db.get_item(btc_address))
+        btc_balances_db.remove_item(btc_address, "satoshi")
+
 class TestTransactionsDB(unittest.TestCase):
     def test_add_transaction(self):
         # Test adding transactions to TransactionsDB
@@ -67,7 +128,6 @@ class TestTransactionsDB(unittest.TestCase):
         blockchain_api = BlockChainAPI()
 
         btc_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"  # Satoshi's address
-        username = "daniel"
 
         # Get blockchain data
         data = blockchain_api.get_data(btc_address)
@@ -79,7 +139,7 @@ class TestTransactionsDB(unittest.TestCase):
                     t_time = tx['time']
                     t_balance = tx['balance']
                     t_fee = tx['fee']
-                    transactions_db.add_transaction(username, i + 1, btc_address, t_time, t_fee, t_balance)
+                    transactions_db.add_transaction(btc_address, tx['hash'], t_time, t_fee, t_balance)
                 else:
                     print(f"Insufficient data at {i}th instance.")
                     break
@@ -90,6 +150,30 @@ class TestTransactionsDB(unittest.TestCase):
         transactions = transactions_db.get_table(btc_address=btc_address)
         self.assertTrue(len(transactions) > 0)
 
+    def test_get_page(self):
+        # Test paging through transactions with the returned cursor
+        transactions_db = TransactionsDB()
+        btc_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"  # Satoshi's address
+
+        first_page, cursor = transactions_db.get_page(btc_address, page_size=2)
+        self.assertTrue(len(first_page) <= 2)
+        if cursor:
+            second_page, _ = transactions_db.get_page(btc_address, page_size=2, cursor=cursor)
+            self.assertTrue(all(tx['tx_key'] < first_page[-1]['tx_key'] for tx in second_page))
+
+    def test_get_page_exact_multiple(self):
+        # A history that fills its last page exactly has no further (empty) page
+        transactions_db = TransactionsDB()
+        btc_address = f"paging_{uuid.uuid4().hex[:8]}"
+        transactions_db.add_transactions([transactions_db.to_item(btc_address, f'hash{i}', 1700000000 + i, 100, i)
+                                          for i in range(4)])
+        first_page, cursor = transactions_db.get_page(btc_address, page_size=2)
+        self.assertEqual([tx['tx_hash'] for tx in first_page], ['hash3', 'hash2'])
+        second_page, cursor = transactions_db.get_page(btc_address, page_size=2, cursor=cursor)
+        self.assertEqual([tx['tx_hash'] for tx in second_page], ['hash1', 'hash0'])
+        self.assertIsNone(cursor)
+        transactions_db.remove_transactions(btc_address)
+
 # ---------------#
 # main.py TESTS  #
 # ---------------#
@@ -109,7 +193,7 @@ class TestBitcoinAddresses(unittest.TestCase):
         # Test removing a BTC address
         # first added then remove it
         self.bitcoin_addresses.add_address(self.btc_address, self.username)
-        result = self.bitcoin_addresses.remove_address(self.btc_address)
+        result = self.bitcoin_addresses.remove_address(self.btc_address, self.username)
         self.assertTrue(result)
 
     def test_get_btc_addresses_for_user(self):
@@ -126,7 +210,7 @@ class TestSynchronizeBitcoinAddress(unittest.TestCase):
 
     def test_add_transactions(self):
         # Test adding transactions
-        result = self.sync_btc_address.add_transactions(self.username, self.btc_address)
+        result = self.sync_btc_address.add_transactions(self.btc_address)
         self.assertTrue(result)
 
     def test_get_transactions_table_for_btc_address(self):
@@ -134,6 +218,31 @@ class TestSynchronizeBitcoinAddress(unittest.TestCase):
         transactions = self.sync_btc_address.get_transactions_table_for_btc_address(self.btc_address)
         self.assertIsInstance(transactions, list)
 
+class TestChangeDetection(unittest.TestCase):
+    def setUp(self):
+        self.stored = {'btc_address': 'addr', 'time_synced': '2024-01-01T00:00:00+00:00',
+                       'n_tx': 3, 'btc_balance': 5000, 'last_tx_height': 800000}
+        self.summary = {'n_tx': 3, 'final_balance': 5000}
+
+    def test_unchanged_and_confirmed_is_skipped(self):
+        self.assertTrue(SynchronizeBitcoinAddress.is_unchanged(self.stored, self.summary, 800010))
+
+    def test_new_transaction_is_synced(self):
+        summary = {'n_tx': 4, 'final_balance': 6000}
+        self.assertFalse(SynchronizeBitcoinAddress.is_unchanged(self.stored, summary, 800010))
+
+    def test_shallow_transaction_is_resynced(self):
+        # Only 2 confirmations, could still be reorged away
+        self.assertFalse(SynchronizeBitcoinAddress.is_unchanged(self.stored, self.summary, 800001))
+
+    def test_never_synced_is_synced(self):
+        self.assertFalse(SynchronizeBitcoinAddress.is_unchanged(None, self.summary, 800010))
+
+    def test_shallow_transaction_is_skipped_until_next_block(self):
+        stored = dict(self.stored, synced_height=800001)
+        self.assertTrue(SynchronizeBitcoinAddress.is_unchanged(stored, self.summary, 800001))
+        self.assertFalse(SynchronizeBitcoinAddress.is_unchanged(stored, self.summary, 800002))
+
 class TestRetrieveData(unittest.TestCase):
     def setUp(self):
         # Initialize test objects
@@ -190,6 +299,31 @@ class TestBlockChainAPI(unittest.TestCase):
         actual_balance = self.blockchain_api.get_balance(btc_address)
         self.assertEqual(actual_balance, expected_balance)
 
+    def test_get_summary_is_cached(self):
+        btc_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+        response = unittest.mock.Mock(status_code=200)
+        response.json.return_value = {btc_address: {'final_balance': 5000, 'n_tx': 3, 'total_received': 5000}}
+        with patch('blockchain_com_api.BlockChainAPI._get', return_value=response) as mock_get:
+            first = self.blockchain_api.get_summary([btc_address])
+            second = self.blockchain_api.get_summary([btc_address])
+
+        self.assertEqual(first, second)
+        self.assertEqual(first[btc_address]['n_tx'], 3)
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_get_latest_block_is_cached(self):
+        response = unittest.mock.Mock(status_code=200)
+        response.json.return_value = {'hash': '00ab', 'height': 800000, 'time': 1700000000, 'block_index': 800000}
+        with patch('blockchain_com_api.BlockChainAPI._get', return_value=response) as mock_get:
+            first = self.blockchain_api.get_latest_block()
+            second = self.blockchain_api.get_latest_block()
+            uncached_api = BlockChainAPI(summary_ttl=0)
+            uncached_api.get_latest_block()
+            uncached_api.get_latest_block()
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_get.call_count, 3)
+
     def test_get_balance_exception(self):
         btc_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
         # Simulate exception when retrieving data
@@ -198,5 +332,584 @@ class TestBlockChainAPI(unittest.TestCase):
 
         self.assertIsNone(balance)
 
+# ---------------- #
+# metrics.py TESTS #
+# ---------------- #
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter_render(self):
+        counter = self.registry.counter('test_requests_total', 'Test requests.')
+        counter.inc(endpoint='rawaddr', status='200')
+        counter.inc(2, endpoint='rawaddr', status='200')
+        self.assertEqual(counter.value(endpoint='rawaddr', status='200'), 3)
+        self.assertIn('test_requests_total{endpoint="rawaddr",status="200"} 3', self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('test_seconds', 'Test latency.', buckets=(0.1, 1.0))
+        histogram.observe(0.05, route='/')
+        histogram.observe(0.5, route='/')
+        histogram.observe(5.0, route='/')
+        rendered = self.registry.render()
+        self.assertIn('test_seconds_bucket{route="/",le="0.1"} 1', rendered)
+        self.assertIn('test_seconds_bucket{route="/",le="1"} 2', rendered)
+        self.assertIn('test_seconds_bucket{route="/",le="+Inf"} 3', rendered)
+        self.assertIn('test_seconds_count{route="/"} 3', rendered)
+
+    def test_record_ddb_response(self):
+        before = metrics.DDB_CONSUMED_CAPACITY.value(table='test', operation='scan')
+        metrics.record_ddb_response('test', 'scan', {'ConsumedCapacity': {'CapacityUnits': 2.5},
+                                                     'Count': 3, 'ScannedCount': 10})
+        self.assertEqual(metrics.DDB_CONSUMED_CAPACITY.value(table='test', operation='scan') - before, 2.5)
+        self.assertGreaterEqual(metrics.DDB_ITEMS.value(table='test', operation='scan', kind='scanned'), 10)
+
+# ------------------- #
+# benchmarks.py TESTS #
+# ------------------- #
+class TestBenchmarks(unittest.TestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(benchmarks.percentile(samples, 50), 50)
+        self.assertEqual(benchmarks.percentile(samples, 99), 99)
+        self.assertEqual(benchmarks.percentile([], 50), 0.0)
+
+    def test_fake_blockchain_api(self):
+        fake_api = benchmarks.FakeBlockChainAPI(num_of_transactions=25)
+        data = fake_api.get_data('fake000001')
+        self.assertEqual(len(data['txs']), 25)
+        self.assertEqual(data['final_balance'], data['txs'][-1]['balance'])
+        self.assertFalse(fake_api.valid_btc_address('invalidaddress'))
+
+    def test_seed_transactions(self):
+        fake_api = benchmarks.FakeBlockChainAPI(num_of_transactions=75)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            backend = SQLiteBackend(os.path.join(tmp_dir, 'test.db'))
+            transactions_db = backend.transactions()
+            deepest = benchmarks.seed_transactions(transactions_db, fake_api, ['fake000001'], chunk_size=30)
+            self.assertEqual(len(transactions_db.get_history('fake000001')), 75)  # beyond one /rawaddr page
+            page, cursor = transactions_db.get_page(*next(deepest))
+            self.assertEqual([item['tx_hash'] for item in page], [tx['hash'] for tx in fake_api.history('fake000001')[-20:]])
+            self.assertIsNone(cursor)
+            backend.db.close()
+
+    def test_compare_to_baseline(self):
+        baseline = {'results': {'retrieve': {'p50_ms': 10.0, 'p99_ms': 20.0}}}
+        current = {'results': {'retrieve': {'p50_ms': 10.5, 'p99_ms': 30.0}}}
+        regressions = benchmarks.compare_to_baseline(current, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('p99_ms', regressions[0])
+
+# ------------------ #
+# profiling.py TESTS #
+# ------------------ #
+class TestRequestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.profiler = RequestProfiler(self.app, profile_dir=self.profile_dir, token='admin', sample_rate=0)
+
+        @self.app.route('/slow')
+        def slow():
+            with metrics.timer(metrics.DDB_LATENCY, table='users', operation='get_item'):
+                pass
+            return render_template_string('ok')
+
+        self.client = self.app.test_client()
+
+    def test_profile_with_admin_header(self):
+        response = self.client.get('/slow', headers={PROFILE_HEADER: 'admin'})
+        profile_id = response.headers.get(PROFILE_ID_HEADER)
+        self.assertIsNotNone(profile_id)
+
+        json_files = [f for f in os.listdir(self.profile_dir) if f.endswith('.json')]
+        self.assertEqual(len(json_files), 1)
+        with open(os.path.join(self.profile_dir, json_files[0])) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['id'], profile_id)
+        self.assertIn('dynamodb', summary['breakdown_ms'])
+        self.assertEqual(summary['spans'][0]['name'], 'users.get_item')
+
+    def test_no_profile_without_header(self):
+        response = self.client.get('/slow', headers={PROFILE_HEADER: 'wrong-token'})
+        self.assertIsNone(response.headers.get(PROFILE_ID_HEADER))
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+# ------------------- #
+# ddb_client.py TESTS #
+# ------------------- #
+class ThrottledTable:
+    # Table stand-in that throttles the first `throttles` put_item calls
+    name = 'throttled'
+
+    def __init__(self, throttles):
+        self.throttles = throttles
+        self.calls = 0
+
+    def put_item(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+        return {'ConsumedCapacity': {'TableName': self.name, 'CapacityUnits': 1.0}}
+
+class FailingTable:
+    # Table stand-in whose put_item raises each error in `errors` once, then succeeds
+    name = 'failing'
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def put_item(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {}
+
+class SegmentedTable:
+    # Table stand-in honouring Segment/TotalSegments and paginating 3 items per page
+    name = 'segmented'
+
+    def __init__(self, num_of_items):
+        self.items = [{'btc_address': f'addr{i}', 'username': 'satoshi'} for i in range(num_of_items)]
+
+    def scan(self, Segment, TotalSegments, ExclusiveStartKey=None, **kwargs):
+        segment_items = [item for i, item in enumerate(self.items) if i % TotalSegments == Segment]
+        start = ExclusiveStartKey['offset'] if ExclusiveStartKey else 0
+        response = {'Items': segment_items[start:start + 3], 'Count': len(segment_items[start:start + 3])}
+        if start + 3 < len(segment_items):
+            response['LastEvaluatedKey'] = {'offset': start + 3}
+        return response
+
+class TestDynamoDBClient(unittest.TestCase):
+    def setUp(self):
+        self.ddb = DynamoDBClient(max_attempts=4, base_delay=0.001, max_delay=0.01)
+
+    def test_retries_throttled_requests(self):
+        table = ThrottledTable(throttles=2)
+        self.ddb.request(table, 'put_item', Item={'id': '1'})
+        self.assertEqual(table.calls, 3)
+        self.assertIsNotNone(self.ddb.limiter(table.name).rate)
+
+    def test_raises_after_max_attempts(self):
+        table = ThrottledTable(throttles=10)
+        with self.assertRaises(ClientError):
+            self.ddb.request(table, 'put_item', Item={'id': '1'})
+        self.assertEqual(table.calls, 4)
+
+    def test_retries_transient_errors(self):
+        table = FailingTable([
+            ClientError({'Error': {'Code': 'InternalServerError'}}, 'PutItem'),
+            ClientError({'Error': {'Code': 'Unknown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, 'PutItem'),
+            EndpointConnectionError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com'),
+            ReadTimeoutError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com'),
+        ])
+        self.ddb = DynamoDBClient(max_attempts=5, base_delay=0.001, max_delay=0.01)
+        self.ddb.request(table, 'put_item', Item={'id': '1'})
+        self.assertEqual(table.calls, 5)
+        self.assertIsNone(self.ddb.limiter(table.name).rate)  # not throttling: rate unchanged
+
+    def test_does_not_retry_client_errors(self):
+        table = FailingTable([ClientError({'Error': {'Code': 'ValidationException'},
+                                           'ResponseMetadata': {'HTTPStatusCode': 400}}, 'PutItem')])
+        with self.assertRaises(ClientError):
+            self.ddb.request(table, 'put_item', Item={'id': '1'})
+        self.assertEqual(table.calls, 1)
+
+    def test_parallel_scan_reads_every_segment_and_page(self):
+        table = SegmentedTable(num_of_items=25)
+        pages = list(self.ddb.parallel_scan(table, total_segments=4, projection=['btc_address']))
+        addresses = sorted(item['btc_address'] for page in pages for item in page)
+        self.assertEqual(addresses, sorted(item['btc_address'] for item in table.items))
+        self.assertTrue(all(len(page) <= 3 for page in pages))
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def test_engages_on_throttle_and_recovers(self):
+        limiter = AdaptiveRateLimiter(throttled_rate=100.0, max_rate=102.0, increase=1.0)
+        self.assertIsNone(limiter.rate)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 100.0)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 50.0)
+        for _ in range(52):
+            limiter.on_success()
+        self.assertIsNone(limiter.rate)
+
+# ------------- #
+# auth.py TESTS #
+# ------------- #
+class InMemoryUsersDB:
+    # UsersDB stand-in counting get_user round trips
+    def __init__(self, hasher):
+        self.hasher = hasher
+        self.users = {}
+        self.get_user_calls = 0
+
+    def add_user(self, username, password):
+        self.users[username] = {'username': username, 'password_hash': self.hasher.hash_password(password)}
+        return True
+
+    def get_user(self, username):
+        self.get_user_calls += 1
+        return self.users.get(username)
+
+    def set_password_hash(self, username, password_hash):
+        self.users[username].pop('password', None)
+        self.users[username]['password_hash'] = password_hash
+        return True
+
+class TestPasswordHasher(unittest.TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher(n=2 ** 10, max_workers=2)
+
+    def test_hash_and_verify(self):
+        password_hash = self.hasher.hash_password("cointracker_pw")
+        self.assertNotIn("cointracker_pw", password_hash)
+        self.assertTrue(self.hasher.verify_password("cointracker_pw", password_hash))
+        self.assertFalse(self.hasher.verify_password("wrong_pw", password_hash))
+
+    def test_hashes_are_salted(self):
+        self.assertNotEqual(self.hasher.hash_password("pw"), self.hasher.hash_password("pw"))
+
+    def test_malformed_hash(self):
+        self.assertFalse(self.hasher.verify_password("pw", "not-a-hash"))
+
+class TestUserCache(unittest.TestCase):
+    def test_ttl_expiry(self):
+        cache = UserCache(ttl=0)
+        cache.put("daniel", {'username': "daniel"})
+        self.assertIsNone(cache.get("daniel"))
+
+    def test_invalidate(self):
+        cache = UserCache(ttl=60)
+        cache.put("daniel", {'username': "daniel"})
+        self.assertEqual(cache.get("daniel"), {'username': "daniel"})
+        cache.invalidate("daniel")
+        self.assertIsNone(cache.get("daniel"))
+
+    def test_lru_bound(self):
+        cache = UserCache(ttl=60, max_entries=2)
+        for username in ("a", "b", "c"):
+            cache.put(username, {'username': username})
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+class TestUserSessions(unittest.TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher(n=2 ** 10, max_workers=2)
+        self.users_db = InMemoryUsersDB(self.hasher)
+        self.sessions = UserSessions(self.users_db, hasher=self.hasher, cache=UserCache(ttl=60))
+
+    def test_load_user_is_cached(self):
+        self.sessions.register("daniel", "cointracker_pw")
+        for _ in range(5):
+            user_data = self.sessions.load_user("daniel")
+        self.assertEqual(user_data, {'username': "daniel"})
+        self.assertEqual(self.users_db.get_user_calls, 1)
+
+    def test_authenticate(self):
+        self.sessions.register("daniel", "cointracker_pw")
+        self.assertIsNone(self.sessions.authenticate("daniel", "wrong_pw"))
+        self.assertIsNotNone(self.sessions.authenticate("daniel", "cointracker_pw"))
+        self.assertIsNone(self.sessions.authenticate("nobody", "cointracker_pw"))
+
+    def test_legacy_plaintext_password_is_upgraded(self):
+        self.users_db.users["satoshi"] = {'username': "satoshi", 'password': "legacy_pw"}
+        self.assertIsNotNone(self.sessions.authenticate("satoshi", "legacy_pw"))
+        self.assertNotIn('password', self.users_db.users["satoshi"])
+        self.assertTrue(self.hasher.verify_password("legacy_pw", self.users_db.users["satoshi"]['password_hash']))
+
+# ------------------ #
+# fragments.py TESTS #
+# ------------------ #
+class TestFragmentCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = FragmentCache(name='test_fragments', max_entries=2)
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return "<table>...</table>"
+
+    def test_hit_skips_render(self):
+        first = self.cache.get_or_render(('table', 'addr', 'v1'), self.render)
+        second = self.cache.get_or_render(('table', 'addr', 'v1'), self.render)
+        self.assertEqual(first, second)
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='test_fragments', result='hit'), 1)
+
+    def test_new_version_rerenders(self):
+        self.cache.get_or_render(('table', 'addr', 'v1'), self.render)
+        self.cache.get_or_render(('table', 'addr', 'v2'), self.render)
+        self.assertEqual(self.renders, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.get_or_render(key, self.render)
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get_or_render('a', self.render)
+        self.assertEqual(self.renders, 4)
+
+# ------------------------------------- #
+# storage.py / sqlite_store.py TESTS    #
+# ------------------------------------- #
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, 'test.db'))
+        self.fake_api = benchmarks.FakeBlockChainAPI(num_of_transactions=25)
+        self.btc_balances_db = self.backend.btc_balances()
+        self.btc_balances_db.blockchain_api = self.fake_api
+        self.transactions_db = self.backend.transactions()
+
+    def tearDown(self):
+        self.backend.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_wal_mode(self):
+        journal_mode = self.backend.db.connection().execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+
+    def test_no_secondary_indexes(self):
+        indexes = self.backend.db.connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+        self.assertEqual(indexes, [])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_backend('cassandra')
+
+    def test_users(self):
+        users_db = self.backend.users()
+        self.assertTrue(users_db.add_user("satoshi", "nakamoto"))
+        self.assertFalse(users_db.add_user("satoshi", "other"))  # existing users are not overwritten
+        user = users_db.get_user("satoshi")
+        self.assertTrue(PasswordHasher().verify_password("nakamoto", user['password_hash']))
+        self.assertIsNone(users_db.get_user("unknown"))
+
+    def test_shared_address_lifecycle(self):
+        self.assertTrue(self.btc_balances_db.add_item('fake000001', 'alice'))
+        self.assertTrue(self.btc_balances_db.add_item('fake000001', 'bob'))
+        self.assertEqual(self.btc_balances_db.get_item('fake000001')['subscribers'], 2)
+        self.assertEqual(self.btc_balances_db.get_btc_addresses_for_user('alice'), {'fake000001'})
+        self.assertFalse(self.btc_balances_db.add_item('invalidaddress', 'alice'))
+
+        self.transactions_db.add_transaction('fake000001', 'hash0', 1700000000, 100, 5000)
+        self.assertTrue(self.btc_balances_db.remove_item('fake000001', 'alice'))
+        self.assertFalse(self.btc_balances_db.remove_item('fake000001', 'alice'))
+        self.assertIsNotNone(self.btc_balances_db.get_item('fake000001'))
+        self.assertTrue(self.btc_balances_db.remove_item('fake000001', 'bob'))
+        self.assertIsNone(self.btc_balances_db.get_item('fake000001'))
+        self.assertEqual(self.transactions_db.get_table('fake000001'), [])
+
+    def test_sync_state_and_batch_get(self):
+        for btc_address in ('fake000001', 'fake000002'):
+            self.btc_balances_db.add_item(btc_address, 'alice')
+        self.assertNotIn('time_synced', self.btc_balances_db.get_item('fake000001'))
+        self.assertTrue(self.btc_balances_db.mark_synced('fake000001', 25, 1234, 800000, 800100))
+        items = self.btc_balances_db.get_items(['fake000001', 'fake000002', 'fake000003'])
+        self.assertEqual(set(items), {'fake000001', 'fake000002'})
+        self.assertEqual(items['fake000001']['btc_balance'], 1234)
+        self.assertIn('time_synced', items['fake000001'])
+        pages = list(self.btc_balances_db.iter_pages(projection=['btc_address']))
+        self.assertEqual([item['btc_address'] for page in pages for item in page], ['fake000001', 'fake000002'])
+
+    def test_bulk_insert_and_pages(self):
+        items = [self.transactions_db.to_item('fake000001', f'hash{i}', 1700000000 + i * 60, 100, i)
+                 for i in range(45)]
+        self.assertTrue(self.transactions_db.add_transactions(items))
+        self.assertTrue(self.transactions_db.add_transactions(items[:5]))  # re-sync overwrites, no duplicates
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = self.transactions_db.get_page('fake000001', page_size=20, cursor=cursor)
+            seen.extend(item['tx_hash'] for item in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f'hash{i}' for i in reversed(range(45))])
+
+        self.transactions_db.remove_transaction_keys([{'btc_address': 'fake000001', 'tx_key': items[-1]['tx_key']}])
+        self.assertEqual(self.transactions_db.get_table('fake000001', 1)[0]['tx_hash'], 'hash43')
+
+    def test_resync_after_rows_deleted(self):
+        storage.set_backend(self.backend)
+        self.addCleanup(storage.set_backend, None)
+        sync = SynchronizeBitcoinAddress()
+        sync.blockchain_api = self.fake_api
+        self.assertTrue(sync.add_transactions('fake000001'))
+        self.transactions_db.remove_transactions('fake000001')  # e.g. the last user removed the address
+        self.assertTrue(sync.add_transactions('fake000001'))
+        self.assertEqual(len(self.transactions_db.get_table('fake000001', 50)), 25)
+
+    def test_latest_transactions_across_addresses(self):
+        storage.set_backend(self.backend)
+        self.addCleanup(storage.set_backend, None)
+        self.transactions_db.add_transactions([self.transactions_db.to_item('fake000001', f'hash{i}', 1700000000 + i, 100, i * 100000000)
+                                               for i in range(40)])
+        self.transactions_db.add_transaction('fake000002', 'old', 1600000000, 100, 1)
+        btc_transactions = RetrieveData().get_btc_transactions(['fake000001', 'fake000002'], 50)
+        self.assertEqual(len(btc_transactions), 41)
+        self.assertEqual([tx['current_balance'] for tx in btc_transactions[:40]], list(reversed(range(40))))
+        self.assertEqual(btc_transactions[-1]['btc_address'], 'fake000002')
+
+    def test_synced_history_spans_pages(self):
+        storage.set_backend(self.backend)
+        self.addCleanup(storage.set_backend, None)
+        sync = SynchronizeBitcoinAddress()
+        sync.blockchain_api = self.fake_api
+        self.assertTrue(sync.add_transactions('fake000001'))
+        page, cursor = sync.get_transactions_page('fake000001', page_size=20)
+        self.assertEqual(len(page), 20)
+        page, cursor = sync.get_transactions_page('fake000001', page_size=20, cursor=cursor)
+        self.assertEqual((len(page), cursor), (5, None))
+
+# ------------- #
+# jobs.py TESTS #
+# ------------- #
+class TestRefreshAllAddresses(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, 'test.db'))
+        storage.set_backend(self.backend)
+        self.fake_api = benchmarks.FakeBlockChainAPI(num_of_transactions=15)
+        btc_balances_db = self.backend.btc_balances()
+        btc_balances_db.blockchain_api = self.fake_api
+        self.btc_addresses = [f'fake{i:06d}' for i in range(5)]
+        for btc_address in self.btc_addresses:
+            btc_balances_db.add_item(btc_address, 'alice')
+        self.job = RefreshAllAddresses(total_segments=2, max_workers=2, chunk_size=2)
+        self.job.sync.blockchain_api = self.fake_api
+
+    def tearDown(self):
+        storage.set_backend(None)
+        self.backend.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_only_changed_addresses_are_downloaded(self):
+        self.assertEqual(self.job.run(), {'refreshed': 5, 'failed': 0})
+        self.fake_api.add_transaction('fake000003', 5000)
+        with patch.object(self.fake_api, 'get_data', wraps=self.fake_api.get_data) as get_data, \
+                patch.object(self.fake_api, 'get_balance') as get_balance:
+            self.assertEqual(self.job.run(), {'refreshed': 5, 'failed': 0})
+        self.assertEqual([call.args[0] for call in get_data.call_args_list], ['fake000003'])
+        get_balance.assert_not_called()
+        item = self.backend.btc_balances().get_item('fake000003')
+        self.assertEqual(item['btc_balance'], self.fake_api.get_data('fake000003')['final_balance'])
+        self.assertEqual(item['synced_height'], self.fake_api.chain_height)
+
+# ------------------ #
+# valuation.py TESTS #
+# ------------------ #
+class TestValuation(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.prices = PriceStore(os.path.join(self.tmp_dir.name, 'prices'))
+        PriceSeries.write(self.prices.path('USD'), [200, 100, 300, 300], [20.0, 10.0, 30.0, 31.0])
+        self.backend = SQLiteBackend(os.path.join(self.tmp_dir.name, 'test.db'))
+
+    def tearDown(self):
+        self.backend.db.close()
+        self.tmp_dir.cleanup()
+
+    def test_asof_join(self):
+        series = self.prices.get('usd')
+        self.assertEqual(self.prices.currencies(), ['USD'])
+        self.assertIsInstance(series.timestamps, np.memmap)
+        prices = series.asof(np.array([50, 100, 150, 299, 1000]))
+        self.assertTrue(np.isnan(prices[0]))  # before the first price
+        self.assertEqual(prices[1:].tolist(), [10.0, 10.0, 20.0, 31.0])  # last duplicate wins
+        self.assertIsNone(self.prices.get('EUR'))
+        with self.assertRaises(ValueError):
+            self.prices.get('../USD')
+
+    def test_import_csv(self):
+        csv_path = os.path.join(self.tmp_dir.name, 'eur.csv')
+        with open(csv_path, 'w') as f:
+            f.write("timestamp,price\n1970-01-01T00:01:40,9.5\n200,19.5\n")
+        self.assertEqual(self.prices.import_csv('EUR', csv_path), 2)
+        self.assertEqual(self.prices.get('EUR').asof(np.array([150])).tolist(), [9.5])
+
+    def test_total_balance(self):
+        # address 0: 1 BTC at t=100, 3 BTC at t=300; address 1: 2 BTC at t=200
+        history = PortfolioHistory(np.array([0, 1, 0]), np.array([300, 200, 100]),
+                                   np.array([3, 2, 1]) * 100000000, np.array([0, 0, 0]))
+        timestamps, total = history.total_balance()
+        self.assertEqual(timestamps.tolist(), [100, 200, 300])
+        self.assertEqual((total / 100000000).tolist(), [1.0, 3.0, 5.0])
+        self.assertEqual((history.balance_changes() / 100000000).tolist(), [2.0, 2.0, 1.0])
+
+    def test_value_portfolio_is_cached_per_sync_version(self):
+        transactions_db = self.backend.transactions()
+        transactions_db.add_transactions([transactions_db.to_item('fake000001', f'hash{i}', 100 + i * 100, 1000, (i + 1) * 100000000)
+                                          for i in range(3)])
+        valuation = PortfolioValuation(self.prices, self.backend)
+        result = valuation.value_portfolio('satoshi', ['fake000001'])
+        self.assertEqual(result['total_value'].tolist(), [10.0, 40.0, 93.0])
+        self.assertEqual(result['current_value'], 93.0)
+        self.assertEqual(result['tx_value'].tolist(), [10.0, 20.0, 31.0])  # +1 BTC each, at 10, 20 and 31
+        self.assertEqual(result['tx_fee_value'].tolist(), [1e-05 * 10, 1e-05 * 20, 1e-05 * 31])
+        self.assertEqual(set(to_json(result)), set(result))  # every field is served by /valuation
+        self.assertIs(valuation.value_portfolio('satoshi', ['fake000001']), result)
+        self.assertIsNot(valuation.value_portfolio('satoshi', ['fake000001', 'fake000002']), result)
+        self.assertIsNone(valuation.value_portfolio('satoshi', ['fake000001'], 'EUR'))
+
+# ------------------- #
+# coalescing.py TESTS #
+# ------------------- #
+class TestWriteCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.fail = False
+        self.coalescer = WriteCoalescer('test_writes', self.write, key_fields=('btc_address',),
+                                        window=60, batch_size=2)
+
+    def write(self, items):
+        self.batches.append([item['btc_address'] for item in items])
+        return not self.fail
+
+    def test_repeated_updates_collapse(self):
+        self.coalescer.put({'btc_address': 'a', 'btc_balance': 1})
+        self.coalescer.put({'btc_address': 'a', 'btc_balance': 2})
+        self.assertEqual(len(self.coalescer), 1)
+        self.assertTrue(self.coalescer.flush())
+        self.assertEqual(self.batches, [['a']])
+        self.assertTrue(self.coalescer.is_persisted([{'btc_address': 'a', 'btc_balance': 2}]))
+
+    def test_identical_writes_are_skipped(self):
+        self.coalescer.mark_persisted([{'btc_address': 'a', 'btc_balance': Decimal('5')}])  # as read from DynamoDB
+        self.assertFalse(self.coalescer.put({'btc_address': 'a', 'btc_balance': 5}))
+        self.coalescer.put({'btc_address': 'b', 'btc_balance': 1})
+        self.coalescer.flush()
+        self.assertFalse(self.coalescer.put({'btc_address': 'b', 'btc_balance': 1}))
+        self.assertEqual(self.batches, [['b']])
+
+    def test_forgotten_keys_are_rewritten(self):
+        self.coalescer.put({'btc_address': 'a', 'btc_balance': 1})
+        self.coalescer.flush()
+        self.coalescer.forget([('a',)])  # row deleted
+        self.assertTrue(self.coalescer.put({'btc_address': 'a', 'btc_balance': 1}))
+        self.coalescer.flush()
+        self.assertEqual(self.batches, [['a'], ['a']])
+
+    def test_flush_in_batches(self):
+        self.coalescer.put_many({'btc_address': address, 'btc_balance': 1} for address in 'abcde')
+        self.coalescer.flush()
+        self.assertEqual(self.batches, [['a', 'b'], ['c', 'd'], ['e']])
+
+    def test_failed_writes_are_not_persisted(self):
+        self.fail = True
+        self.coalescer.put({'btc_address': 'a', 'btc_balance': 1})
+        self.assertFalse(self.coalescer.flush())
+        self.assertFalse(self.coalescer.is_persisted([{'btc_address': 'a', 'btc_balance': 1}]))
+        self.assertTrue(self.coalescer.put({'btc_address': 'a', 'btc_balance': 1}))  # retried, not skipped
+
+    def test_window_flushes_in_background(self):
+        coalescer = WriteCoalescer('test_writes', self.write, key_fields=('btc_address',), window=0.01)
+        coalescer.put({'btc_address': 'a', 'btc_balance': 1})
+        deadline = time.monotonic() + 2
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.batches, [['a']])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,354 @@
+# valuation.py
+"""
+Historical fiat valuation of BTC portfolios.
+
+Prices are read from local BTC/<currency> series, one `.npy` file per currency in
+COINTRACKER_PRICE_DIR (default `prices/`), memory-mapped rather than loaded. Import
+a CSV of `timestamp,price` rows (unix seconds or ISO dates) with:
+
+    python valuation.py import-prices USD btc_usd.csv
+"""
+import argparse
+import csv
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from storage import get_backend
+
+logger = logging.getLogger(__name__)
+
+SATOSHI = 100000000
+CURRENCY_PATTERN = re.compile(r'^[A-Z]{3}$')
+
+
+class PriceSeries:
+    """
+    BTC price in one fiat currency over time.
+
+    Stored as a single (2, n) float64 array (row 0: unix timestamps, ascending; row 1: prices)
+    and memory-mapped, so only the pages touched by a lookup are read from disk and the
+    series is shared between processes through the page cache.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        stat = os.stat(path)
+        self.version = (stat.st_mtime_ns, stat.st_size)  # changes when the file is re-imported
+        data = np.load(path, mmap_mode='r')
+        if data.ndim != 2 or data.shape[0] != 2:
+            raise ValueError(f"Price series '{path}' must have shape (2, n), got {data.shape}.")
+        self.timestamps = data[0]
+        self.prices = data[1]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @staticmethod
+    def write(path: str, timestamps, prices) -> None:
+        """
+        Store a series (sorted by timestamp; the last price wins for duplicate timestamps).
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, prices = timestamps[order], prices[order]
+        last = np.append(timestamps[1:] != timestamps[:-1], True)  # keep the last of each run of duplicates
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp.npy'
+        np.save(tmp_path, np.stack([timestamps[last], prices[last]]))
+        os.replace(tmp_path, path)  # readers never see a half-written series
+
+    def asof(self, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Price in effect at each timestamp (the latest price at or before it), NaN before the
+        first price. One binary search per timestamp, done in a single vectorized call.
+        """
+        if not len(self):
+            return np.full(len(timestamps), np.nan)
+        index = np.searchsorted(self.timestamps, timestamps, side='right') - 1
+        prices = self.prices[np.maximum(index, 0)]
+        return np.where(index >= 0, prices, np.nan)
+
+    def latest(self) -> Tuple[Optional[float], Optional[float]]:
+        """
+        (timestamp, price) of the newest price, or (None, None) for an empty series.
+        """
+        if not len(self):
+            return None, None
+        return float(self.timestamps[-1]), float(self.prices[-1])
+
+
+class PriceStore:
+    """
+    Loads the price series of each currency from `price_dir` on first use and reloads a
+    series when its file is replaced.
+    """
+    def __init__(self, price_dir: str = None):
+        self.price_dir = price_dir or os.environ.get('COINTRACKER_PRICE_DIR', 'prices')
+        self._series: Dict[str, PriceSeries] = {}
+        self._lock = threading.Lock()
+
+    def path(self, currency: str) -> str:
+        currency = currency.upper()
+        if not CURRENCY_PATTERN.match(currency):
+            raise ValueError(f"Invalid currency code '{currency}'.")
+        return os.path.join(self.price_dir, f'BTC-{currency}.npy')
+
+    def currencies(self) -> List[str]:
+        """
+        Currencies that have a price series.
+        """
+        if not os.path.isdir(self.price_dir):
+            return []
+        return sorted(name[4:-4] for name in os.listdir(self.price_dir)
+                      if name.startswith('BTC-') and name.endswith('.npy') and CURRENCY_PATTERN.match(name[4:-4]))
+
+    def get(self, currency: str) -> Optional[PriceSeries]:
+        """
+        Price series of currency, or None if there is none.
+        """
+        path = self.path(currency)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            series = self._series.get(currency.upper())
+            if series is None or series.version != (stat.st_mtime_ns, stat.st_size):
+                series = self._series[currency.upper()] = PriceSeries(path)
+                logger.info("Loaded %s BTC-%s prices from '%s'.", len(series), currency.upper(), path)
+            return series
+
+    def import_csv(self, currency: str, csv_path: str) -> int:
+        """
+        Convert a CSV of `timestamp,price` rows (unix seconds or ISO dates, optional header)
+        to the memory-mapped format.
+
+        Returns:
+            Number of prices imported.
+        """
+        timestamps, prices = [], []
+        with open(csv_path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 2:
+                    continue
+                try:
+                    price = float(row[1])
+                except ValueError:
+                    continue  # header
+                timestamps.append(_parse_timestamp(row[0]))
+                prices.append(price)
+        PriceSeries.write(self.path(currency), timestamps, prices)
+        return len(prices)
+
+
+def _parse_timestamp(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+class PortfolioHistory:
+    """
+    Every stored transaction of a set of addresses as flat arrays (one element per transaction).
+    """
+    def __init__(self, address_index: np.ndarray, timestamps: np.ndarray, balances: np.ndarray, fees: np.ndarray):
+        self.address_index = address_index
+        self.timestamps = timestamps
+        self.balances = balances
+        self.fees = fees
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def balance_changes(self) -> np.ndarray:
+        """
+        Balance change of each transaction (in history order), in satoshi.
+
+        Each stored balance is an address's balance after a transaction, so a transaction
+        changed it by the difference to that address's previous balance. Sorting by (address,
+        time) and differencing give every change without any per-row Python work. The oldest
+        stored transaction of an address counts its full balance.
+        """
+        by_address = np.lexsort((self.timestamps, self.address_index))
+        balances = self.balances[by_address]
+        address_index = self.address_index[by_address]
+        deltas = np.diff(balances, prepend=0)
+        first = np.ones(len(balances), dtype=bool)
+        first[1:] = address_index[1:] != address_index[:-1]
+        deltas[first] = balances[first]
+        changes = np.empty_like(deltas)
+        changes[by_address] = deltas
+        return changes
+
+    def time_order(self) -> np.ndarray:
+        """
+        Indices that sort the transactions by time (stable, so ties keep history order).
+        """
+        return np.argsort(self.timestamps, kind='stable')
+
+    def total_balance(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Total balance over all addresses after each transaction: the cumulative sum of
+        the balance changes over time.
+
+        Returns:
+            (timestamps ascending, total balance in satoshi at each timestamp).
+        """
+        order = self.time_order()
+        return self.timestamps[order], np.cumsum(self.balance_changes()[order])
+
+
+class PortfolioValuation:
+    """
+    Values a user's stored transactions and balance history in a fiat currency.
+
+    Results are cached per user and keyed by the sync version of every address and the
+    version of the price file, so a cached valuation is reused until an address is
+    re-synced or prices are re-imported.
+    """
+    def __init__(self, prices: PriceStore = None, backend=None, max_entries: int = None):
+        backend = backend or get_backend()
+        self.prices = prices or PriceStore()
+        self.transactions_db = backend.transactions()
+        self.btc_balances_db = backend.btc_balances()
+        self.max_entries = max_entries or int(os.environ.get('COINTRACKER_VALUATION_CACHE_SIZE', 1000))
+        self._cache: 'OrderedDict[Tuple[str, str], Tuple[Hashable, dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load_history(self, btc_addresses: List[str]) -> PortfolioHistory:
+        """
+        Stored transactions of btc_addresses as arrays.
+        """
+        address_index, timestamps, balances, fees = [], [], [], []
+        for i, btc_address in enumerate(btc_addresses):
+            history = self.transactions_db.get_history(btc_address)
+            address_index.append(np.full(len(history), i, dtype=np.int64))
+            timestamps.append(np.fromiter((int(tx['timestamp']) for tx in history), np.int64, len(history)))
+            balances.append(np.fromiter((int(tx['balance']) for tx in history), np.int64, len(history)))
+            fees.append(np.fromiter((int(tx['fee']) for tx in history), np.int64, len(history)))
+        if not btc_addresses:
+            empty = np.zeros(0, dtype=np.int64)
+            return PortfolioHistory(empty, empty, empty, empty)
+        return PortfolioHistory(np.concatenate(address_index), np.concatenate(timestamps),
+                                np.concatenate(balances), np.concatenate(fees))
+
+    @staticmethod
+    def value_history(history: PortfolioHistory, series: PriceSeries) -> dict:
+        """
+        Value every stored transaction and the total balance after it with as-of prices.
+
+        Returns:
+            Arrays in time order, one element per transaction: 'timestamps', 'tx_value'
+            (balance change times the price at that time), 'tx_fee_value', 'total_btc' and
+            'total_value' (portfolio after the transaction); and the totals 'fees_value',
+            'current_btc' and 'current_value' (at the latest price).
+        """
+        order = history.time_order()
+        timestamps = history.timestamps[order]
+        changes = history.balance_changes()[order]
+        prices = series.asof(timestamps)
+        total_btc = np.cumsum(changes) / SATOSHI
+        tx_fee_value = history.fees[order] / SATOSHI * prices
+        current_btc = float(total_btc[-1]) if len(total_btc) else 0.0
+        price_time, price = series.latest()
+        return {
+            'timestamps': timestamps,
+            'tx_value': changes / SATOSHI * prices,
+            'tx_fee_value': tx_fee_value,
+            'total_btc': total_btc,
+            'total_value': total_btc * prices,
+            'fees_value': float(np.nansum(tx_fee_value)),
+            'current_btc': current_btc,
+            'current_value': current_btc * price if price is not None else None,
+            'price': price,
+            'price_time': price_time,
+        }
+
+    def value_portfolio(self, username: str, btc_addresses: List[str], currency: str = 'USD') -> Optional[dict]:
+        """
+        Valuation of username's addresses in currency (see `value_history`), cached per user.
+
+        Returns:
+            The valuation, or None if there is no price series for currency.
+        """
+        series = self.prices.get(currency)
+        if series is None:
+            return None
+        btc_addresses = sorted(btc_addresses)
+        sync_versions = self.btc_balances_db.get_items(btc_addresses)
+        version = (tuple((btc_address, sync_versions.get(btc_address, {}).get('time_synced'))
+                         for btc_address in btc_addresses), series.version)
+
+        key = (username, currency.upper())
+        with self._lock:
+            entry = self._cache.get(key)
+            hit = entry is not None and entry[0] == version
+            if hit:
+                self._cache.move_to_end(key)
+        metrics.record_cache('valuations', hit)
+        if hit:
+            return entry[1]
+
+        with metrics.timer(metrics.VALUATION_LATENCY, currency=currency.upper()):
+            valuation = self.value_history(self.load_history(btc_addresses), series)
+        valuation['currency'] = currency.upper()
+        with self._lock:
+            self._cache[key] = (version, valuation)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return valuation
+
+
+def to_json(valuation: dict) -> dict:
+    """
+    JSON-serializable transaction values, portfolio series and totals of a valuation (NaN, i.e.
+    no price yet, becomes null).
+    """
+    def as_list(values: np.ndarray) -> list:
+        return [None if np.isnan(value) else value for value in values.tolist()]
+    return {
+        'currency': valuation['currency'],
+        'timestamps': valuation['timestamps'].tolist(),
+        'tx_value': as_list(valuation['tx_value']),
+        'tx_fee_value': as_list(valuation['tx_fee_value']),
+        'total_btc': valuation['total_btc'].tolist(),
+        'total_value': as_list(valuation['total_value']),
+        'fees_value': valuation['fees_value'],
+        'current_btc': valuation['current_btc'],
+        'current_value': valuation['current_value'],
+        'price': valuation['price'],
+        'price_time': valuation['price_time'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CoinTracker fiat price series.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_prices = subparsers.add_parser('import-prices', help='import a timestamp,price CSV for a currency')
+    import_prices.add_argument('currency', help='ISO currency code, e.g. USD')
+    import_prices.add_argument('csv_path', help='CSV file of timestamp,price rows')
+    import_prices.add_argument('--price-dir', default=None, help='price directory (default COINTRACKER_PRICE_DIR or prices/)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'import-prices':
+        store = PriceStore(args.price_dir)
+        count = store.import_csv(args.currency, args.csv_path)
+        logger.info("Imported %s BTC-%s prices to '%s'.", count, args.currency.upper(), store.path(args.currency))
+
+
+if __name__ == '__main__':
+    main()